@@ -0,0 +1,448 @@
+"""
+Transcribe_WhisperX.py
+
+This script:
+* Iterates through the files by walking the directory, once: the episodes of the shard are listed in a
+  manifest (see load_manifest), which later runs read instead, so a restart only transcribes what is left.
+* Decodes the first minutes of each audio file with ffmpeg straight into memory (utils_audio.load_audio),
+  a few episodes ahead of the one being transcribed (utils_audio.prefetch_audio).
+* Writes out the output json from WhisperX (into a scratch file first, which is then renamed into place).
+* With --workers N, runs N worker processes (e.g. one per GPU with --devices cuda:0 cuda:1), which take
+  the episodes from a shared queue; the episodes of a worker that crashes are queued again (see schedule).
+
+WhisperX: https://github.com/m-bain/whisperX
+Warnings are ok to ignore: https://github.com/m-bain/whisperX/issues/258
+
+The presets are the settings of the original runs (Large_Scale_WhisperX.py and
+Small_Scale_WhisperX.py run them); every setting can also be given on its own:
+
+CUDA_VISIBLE_DEVICES=0 python Transcribe_WhisperX.py --preset large
+CUDA_VISIBLE_DEVICES=0 python Transcribe_WhisperX.py --preset small --num-shards 4 --shard-index 0
+python Transcribe_WhisperX.py --preset large --device cpu --compute-type int8 --batch-size 8
+python Transcribe_WhisperX.py --preset small --dry-run
+python Transcribe_WhisperX.py --preset large --workers 2 --devices cuda:0 cuda:1
+python Transcribe_WhisperX.py --preset large --workers 4 --devices cpu --compute-type int8 --threads-per-worker 8
+
+Episodes are assigned to shards by a stable hash of their episode_filename_prefix
+(utils_general.get_shard_index), the same as in the annotation scripts.
+
+Issue from Spotify, will see this being worked around in the code:
+" (aasishp@spotify.com)"
+" (aasishp@spotify.com 2)"
+"""
+
+import collections
+import os
+import inspect
+import json
+import multiprocessing
+import multiprocessing.connection
+import pathlib
+import shutil
+import socket
+import logging
+from datetime import datetime
+import argparse
+from tqdm import tqdm
+
+import utils_general
+import utils_audio
+
+module_name = "whisperx"
+
+# time_amount and split_name name the output dir, max_minutes is where the audio is truncated
+PRESETS = {
+    "large": {"time_amount": "10min", "split_name": "train", "max_minutes": 10},
+    "small": {"time_amount": "2min", "split_name": "test", "max_minutes": 2},
+}
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--preset", type=str, choices=sorted(PRESETS), help="Defaults for --time-amount, --split-name and --max-minutes.")
+    parser.add_argument("--time-amount", type=str, help="Name of the truncated length, used in the default output root (e.g. 10min).")
+    parser.add_argument("--split-name", type=str, help="Name of the split, used in the default output root (e.g. train).")
+    parser.add_argument("--max-minutes", type=float, help="Only transcribe the first MAX_MINUTES minutes of each episode.")
+    parser.add_argument("--input-root", type=str, default=utils_general.PATH_TO_AUDIO_TEST_DIR, help="Directory walked for the .ogg files.")
+    parser.add_argument("--output-root", type=str, help="Directory of the transcripts (default: /data1/maria/Spotify-Podcasts/{split_name}-{time_amount}-whisperx-dir).")
+    parser.add_argument("--manifest-path", type=str, help="JSONL list of the shard's episodes and their status (default: ./manifests/whisperx-{split_name}-{time_amount}-{shard_index}-of-{num_shards}.jsonl).")
+    parser.add_argument("--rebuild-manifest", action="store_true", help="Walk --input-root again (e.g. after adding files), instead of reading the manifest.")
+    parser.add_argument("--model", type=str, default="large-v2", help="WhisperX (faster-whisper) model name.")
+    parser.add_argument("--device", type=str, default="cuda", help="cuda or cpu.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes, each loading its own model (1: transcribe in this process).")
+    parser.add_argument("--devices", type=str, nargs="+", help="Devices the workers are bound to, round-robin, e.g. cuda:0 cuda:1 or cpu (default: --device).")
+    parser.add_argument("--threads-per-worker", type=int, help="CPU threads of each worker; CPU workers are also pinned to their own cores.")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Number of times an episode is tried (e.g. after its worker crashed) before it is given up on.")
+    parser.add_argument("--compute-type", type=str, default="float16", help="e.g. float16 on GPUs, int8 on CPUs.")
+    parser.add_argument("--batch-size", type=int, default=24)
+    utils_general.add_shard_arguments(parser)
+    parser.add_argument("--decode-workers", type=int, default=2, help="Number of threads decoding audio ahead of transcription.")
+    parser.add_argument("--prefetch-depth", type=int, default=4, help="Maximum number of episodes decoded ahead of the one being transcribed.")
+    parser.add_argument("--max-buffered-mb", type=int, help="Stop decoding ahead once this much decoded audio is waiting (default: no limit besides --prefetch-depth).")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the episodes that would be transcribed, without loading the model.")
+    return parser
+
+def parse_args(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    utils_general.check_shard_arguments(parser, args)
+
+    # the preset only fills in what was not given explicitly
+    for name, value in PRESETS.get(args.preset, {}).items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+    for name in ("time_amount", "split_name", "max_minutes"):
+        if getattr(args, name) is None:
+            parser.error(f"--{name.replace('_', '-')} is required unless --preset is given")
+    if args.output_root is None:
+        args.output_root = f"/data1/maria/Spotify-Podcasts/{args.split_name}-{args.time_amount}-{module_name}-dir"
+    if args.devices is None:
+        args.devices = [args.device]
+    for name in ("max_buffered_mb", "prefetch_depth", "decode_workers"):
+        if getattr(args, name) is not None and getattr(args, name) <= 0:
+            parser.error(f"--{name.replace('_', '-')} must be positive")
+    if args.manifest_path is None:
+        args.manifest_path = f"./manifests/{module_name}-{args.split_name}-{args.time_amount}-{args.shard_index}-of-{args.num_shards}.jsonl"
+
+    return args
+
+def scan_episodes(args):
+    # yields a manifest record for every file of this shard under the input root, which is
+    # "done" if this script already created its transcription (ex: re-running due to CUDA out of memory errors)
+    for root, dirs, files in os.walk(args.input_root):
+        for file in files:
+            episode = file.replace(".ogg","")
+
+            # skip the episodes that belong to other shards
+            if not utils_general.is_in_shard(episode, args.num_shards, args.shard_index):
+                continue
+
+            input_filepath = os.path.join(root, file)
+            output_filepath = os.path.join(args.output_root, episode, "transcript.json")
+            stat = os.stat(input_filepath)
+            yield {
+                "episode": episode,
+                "input_path": input_filepath,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "status": "done" if os.path.exists(output_filepath) else "todo",
+                "output_path": output_filepath,
+            }
+
+def get_manifest_header(args):
+    # the first record of the manifest, since the records hold paths under these roots
+    return {"input_root": os.path.abspath(args.input_root), "output_root": os.path.abspath(args.output_root)}
+
+def load_manifest(args, write=True):
+    # returns the manifest as a dict from episode to record; the manifest file starts with a header
+    # (see get_manifest_header) and one full record per episode, and every finished episode appends
+    # {"episode": ..., "status": "done"}, so the later records of an episode update the earlier ones;
+    # a manifest made for other input or output roots is made again
+    header = get_manifest_header(args)
+    records = None
+    if not args.rebuild_manifest and os.path.exists(args.manifest_path):
+        records = utils_general.read_jsonl_records(args.manifest_path)
+        if not records or records[0] != header:
+            print(f"{args.manifest_path} was not made for these input and output roots, walking {args.input_root} again")
+            records = None
+
+    if records is None:
+        records = [header] + list(scan_episodes(args))
+        if write:
+            # written under a temp name first, so that an interrupted scan leaves no partial manifest
+            pathlib.Path(os.path.dirname(os.path.abspath(args.manifest_path))).mkdir(parents=True, exist_ok=True)
+            temp_manifest_path = args.manifest_path + ".tmp"
+            utils_general.delete_file_if_already_exists(temp_manifest_path)
+            utils_general.append_jsonl_records(temp_manifest_path, records)
+            os.replace(temp_manifest_path, args.manifest_path)
+
+    manifest = {}
+    for record in records[1:]:
+        manifest.setdefault(record["episode"], {}).update(record)
+    return manifest
+
+def dry_run(args):
+    # the manifest is only read (or the input root scanned), not written
+    manifest = load_manifest(args, write=False)
+    todo = [record for record in manifest.values() if record["status"] != "done"]
+    for record in todo:
+        print(record["input_path"], record["output_path"])
+    print(f"{len(todo)} episodes to transcribe ({len(manifest) - len(todo)} already transcribed) in shard {args.shard_index} of {args.num_shards}")
+    print(f"model {args.model} on {' '.join(args.devices)} ({args.compute_type}, batch size {args.batch_size}, {args.workers} workers), first {args.max_minutes} min of each episode")
+
+def load_model(args, device, threads=None):
+    # imported here, so that --dry-run works without whisperx
+    import whisperx
+
+    load_kwargs = {}
+    # the number of CPU threads is only a parameter in newer versions of whisperx
+    if threads and "threads" in inspect.signature(whisperx.load_model).parameters:
+        load_kwargs["threads"] = threads
+
+    # 1. Transcribe with original whisper (batched)
+    return whisperx.load_model(args.model, device, compute_type=args.compute_type, **load_kwargs)
+
+def get_scratch_root(args):
+    return os.path.join(args.output_root, ".scratch")
+
+def get_scratch_dir(args, pid=None):
+    # one per process (and host), on the same file system as the transcripts, so that two runs
+    # never share a scratch file and the finished transcripts can be renamed into place
+    return os.path.join(get_scratch_root(args), f"{socket.gethostname()}-{pid or os.getpid()}")
+
+def remove_scratch_root(args):
+    # only once it is empty, since other runs may still be using it
+    try:
+        os.rmdir(get_scratch_root(args))
+    except OSError:
+        pass
+
+def load_episode_audio(args, record):
+    # the error is returned instead of raised, so that it only fails this episode
+    try:
+        return utils_audio.load_audio(record["input_path"], time_to_truncate_to_in_seconds=args.max_minutes*60)
+    except Exception as e:
+        return e
+
+def transcribe_episodes(args, model, records, report):
+    # transcribes the episodes of records (manifest records), calling report("started", episode) before
+    # transcribing each, and then report("done", episode) or report("failed", episode, error)
+    scratch_dir = get_scratch_dir(args)
+    pathlib.Path(scratch_dir).mkdir(parents=True, exist_ok=True)
+
+    # trim and decode each file in one step, in background threads, so that the
+    # next episodes are ready by the time the current one is transcribed
+    episodes = utils_audio.prefetch_audio(
+        records,
+        lambda record: load_episode_audio(args, record),
+        num_workers=args.decode_workers,
+        queue_depth=args.prefetch_depth,
+        max_buffered_mb=args.max_buffered_mb,
+    )
+
+    try:
+        for record, audio in episodes:
+            output_filepath = record["output_path"]
+            if isinstance(audio, Exception):
+                report("failed", record["episode"], repr(audio))
+                continue
+
+            report("started", record["episode"])
+            try:
+
+                # transcribe with whisperx
+                print(record["input_path"], output_filepath)
+                result = model.transcribe(audio, batch_size=args.batch_size)
+
+                # write to file, with the output dir structure created in the same way as the input dir;
+                # the transcript only appears once it is complete
+                scratch_filepath = os.path.join(scratch_dir, f"{record['episode']}.json")
+                with open(scratch_filepath, "w") as f:
+                    json.dump(result, f)
+                pathlib.Path(os.path.dirname(output_filepath)).mkdir(parents=True, exist_ok=True)
+                os.replace(scratch_filepath, output_filepath)
+
+            except Exception as e:
+                report("failed", record["episode"], repr(e))
+                continue
+
+            report("done", record["episode"])
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+def bind_to_device(args, worker_index):
+    # binds this process to the device of the worker (or its CPU cores), which has to happen before
+    # torch is imported, and returns the device to load the model on (cuda:K becomes the only
+    # visible GPU, so the model is loaded on "cuda")
+    device = args.devices[worker_index % len(args.devices)]
+    if device.startswith("cuda:"):
+        os.environ["CUDA_VISIBLE_DEVICES"] = device.split(":", 1)[1]
+        device = "cuda"
+    if args.threads_per_worker:
+        os.environ["OMP_NUM_THREADS"] = str(args.threads_per_worker)
+        if device == "cpu" and hasattr(os, "sched_setaffinity"):
+            num_cpus = os.cpu_count() or 1
+            first_cpu = worker_index * args.threads_per_worker
+            os.sched_setaffinity(0, {(first_cpu + i) % num_cpus for i in range(args.threads_per_worker)})
+    return device
+
+def run_worker(args, worker_index, task_queue, result_conn):
+    # the body of a worker process (see schedule), which binds itself to its device and then
+    # transcribes the episodes it gets from task_queue until it gets None; its reports are sent
+    # on its own pipe, which (unlike a multiprocessing.Queue, whose feeder thread may not have
+    # flushed yet) already holds "started" if decoding crashes it
+    model = load_model(args, bind_to_device(args, worker_index), args.threads_per_worker)
+
+    records = iter(task_queue.get, None)
+    transcribe_episodes(args, model, records, lambda kind, episode, error=None: result_conn.send((kind, episode, error)))
+
+def schedule(args, manifest, todo, pbar):
+    # runs args.workers worker processes (spawned, so that each one sets up its own device); this process
+    # hands out the episodes from a shared queue, keeping each worker a few episodes ahead (so it can
+    # decode them while transcribing), and knows which episodes each worker holds: when a worker dies,
+    # they are queued again and a new worker is started in its place (only the episode it was transcribing
+    # counts as an attempt, not the ones it had only decoded ahead); failed episodes are also queued
+    # again, up to args.max_attempts times. Once the queue is empty, the workers are told to stop (after
+    # the episodes they hold), since a worker waits for more episodes before finishing the ones it holds;
+    # if episodes are queued again after that, workers that stopped are started again
+    context = multiprocessing.get_context("spawn")
+    pending = collections.deque(todo)
+
+    def start_worker(worker_index):
+        task_queue = context.Queue()
+        result_conn, worker_result_conn = context.Pipe(duplex=False)
+        worker = context.Process(target=run_worker, args=(args, worker_index, task_queue, worker_result_conn), daemon=True)
+        worker.start()
+        # so that result_conn reaches EOF once the worker exits
+        worker_result_conn.close()
+        return worker, task_queue, result_conn
+
+    workers = [start_worker(worker_index) for worker_index in range(args.workers)]
+    assigned = [set() for _ in workers]
+    # the episode each worker is transcribing
+    transcribing = [None for _ in workers]
+    # whether each worker was told to stop
+    stopping = [False for _ in workers]
+    # the number of times each worker died outside of an episode since it last finished one
+    crashes = [0 for _ in workers]
+    attempts = {}
+    finished = set()
+
+    def retry(episode, error):
+        attempts[episode] = attempts.get(episode, 0) + 1
+        logging.debug(f"{episode} failed (attempt {attempts[episode]} of {args.max_attempts}): {error}")
+        if attempts[episode] < args.max_attempts:
+            pending.append(manifest[episode])
+        else:
+            # left as "todo" in the manifest, so a later run tries it again
+            finished.add(episode)
+            pbar.update(1)
+
+    def receive(worker_index, result_conn):
+        # handles the reports the worker already sent
+        try:
+            while result_conn.poll():
+                kind, episode, error = result_conn.recv()
+                if kind == "started":
+                    transcribing[worker_index] = episode
+                    continue
+                assigned[worker_index].discard(episode)
+                if transcribing[worker_index] == episode:
+                    transcribing[worker_index] = None
+                # an episode queued again (after its worker died) may be finished twice
+                if episode in finished:
+                    pass
+                elif kind == "done":
+                    # so that later runs skip this episode
+                    utils_general.append_jsonl_records(args.manifest_path, [{"episode": episode, "status": "done"}])
+                    finished.add(episode)
+                    crashes[worker_index] = 0
+                    pbar.update(1)
+                else:
+                    retry(episode, error)
+        except (EOFError, OSError):
+            # the worker exited, which is handled below
+            pass
+
+    while len(finished) < len(todo):
+        for worker_index, (worker, task_queue, _) in enumerate(workers):
+            if stopping[worker_index]:
+                continue
+            while pending and len(assigned[worker_index]) <= args.prefetch_depth:
+                record = pending.popleft()
+                if record["episode"] not in finished:
+                    assigned[worker_index].add(record["episode"])
+                    task_queue.put(record)
+            if not pending:
+                task_queue.put(None)
+                stopping[worker_index] = True
+
+        # (the pipes of the workers that exited are closed below)
+        ready = multiprocessing.connection.wait([result_conn for _, _, result_conn in workers if not result_conn.closed], timeout=5)
+        for worker_index, (_, _, result_conn) in enumerate(workers):
+            if result_conn in ready:
+                receive(worker_index, result_conn)
+
+        for worker_index, (worker, task_queue, result_conn) in enumerate(workers):
+            if worker.is_alive():
+                continue
+            if not result_conn.closed:
+                # e.g. "started" just before it crashed
+                receive(worker_index, result_conn)
+                result_conn.close()
+            if stopping[worker_index] and worker.exitcode == 0:
+                # it stopped after finishing its episodes, and is only needed again for queued episodes
+                if pending:
+                    workers[worker_index] = start_worker(worker_index)
+                    stopping[worker_index] = False
+                continue
+            if transcribing[worker_index] is None:
+                # a crash outside of an episode (e.g. loading the model) is the worker's fault, not an episode's
+                crashes[worker_index] += 1
+            shutil.rmtree(get_scratch_dir(args, worker.pid), ignore_errors=True)
+            for episode in assigned[worker_index] - finished:
+                if episode == transcribing[worker_index]:
+                    retry(episode, f"worker {worker_index} exited with code {worker.exitcode}")
+                else:
+                    pending.append(manifest[episode])
+            assigned[worker_index] = set()
+            transcribing[worker_index] = None
+            if crashes[worker_index] >= args.max_attempts:
+                # e.g. the model cannot be loaded on its device
+                for other_worker, _, _ in workers:
+                    other_worker.terminate()
+                    other_worker.join()
+                    shutil.rmtree(get_scratch_dir(args, other_worker.pid), ignore_errors=True)
+                remove_scratch_root(args)
+                raise RuntimeError(f"Worker {worker_index} ({args.devices[worker_index % len(args.devices)]}) exited {crashes[worker_index]} times in a row")
+            workers[worker_index] = start_worker(worker_index)
+            stopping[worker_index] = False
+
+    for worker_index, (worker, task_queue, result_conn) in enumerate(workers):
+        if not stopping[worker_index]:
+            task_queue.put(None)
+        worker.join()
+        result_conn.close()
+    remove_scratch_root(args)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.dry_run:
+        dry_run(args)
+        return
+
+    # set up logging
+    utils_general.just_create_this_dir("./logs")
+    logging.basicConfig(filename=f"./logs/{module_name}-{datetime.now().isoformat(timespec='seconds')}.log", encoding="utf-8", level=logging.DEBUG)
+
+    manifest = load_manifest(args)
+    todo = [record for record in manifest.values() if record["status"] != "done"]
+
+    # initialize the progress bar
+    pbar = tqdm(total=len(manifest), initial=len(manifest) - len(todo))
+
+    if args.workers > 1:
+        schedule(args, manifest, todo, pbar)
+    else:
+        def report(kind, episode, error=None):
+            if kind == "started":
+                return
+            if kind == "done":
+                # so that later runs skip this episode
+                utils_general.append_jsonl_records(args.manifest_path, [{"episode": episode, "status": "done"}])
+            else:
+                logging.debug(f"{episode} failed: {error}")
+
+            # update the progress bar (because this file is completed)
+            pbar.update(1)
+
+        # (whisperx, and so torch, is only imported by load_model)
+        transcribe_episodes(args, load_model(args, bind_to_device(args, 0), args.threads_per_worker), todo, report)
+        remove_scratch_root(args)
+
+    # close the progress bar
+    pbar.close()
+    print()
+
+if __name__ == "__main__":
+    main()
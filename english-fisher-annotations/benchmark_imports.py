@@ -0,0 +1,50 @@
+"""
+Measures how long importing each module of the annotator takes in a fresh
+interpreter, and whether the import pulls in torch, e.g.
+
+python benchmark_imports.py --repeat 5
+
+For a breakdown by imported module, use python -X importtime -c "import fisher_annotator".
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ["trees", "tb", "utils_trees", "fisher_annotator", "parse_nk"]
+
+TIMER = """
+import sys, time
+start_time = time.perf_counter()
+import {module}
+print(time.perf_counter() - start_time, "torch" in sys.modules)
+"""
+
+
+def time_import(module):
+    output = subprocess.run(
+        [sys.executable, "-c", TIMER.format(module=module)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+        ).stdout.split()
+    return float(output[-2]), output[-1] == "True"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5, help="Number of fresh interpreters per module.")
+    parser.add_argument("--modules", type=str, nargs="+", default=MODULES)
+    args = parser.parse_args()
+
+    print("{:<20} {:>10} {:>10} {:>8}".format("module", "min (s)", "median (s)", "torch"))
+    for module in args.modules:
+        results = [time_import(module) for _ in range(args.repeat)]
+        times = [import_time for import_time, _ in results]
+        print("{:<20} {:>10.3f} {:>10.3f} {:>8}".format(module, min(times), statistics.median(times), "yes" if results[0][1] else "no"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Pure-NumPy version of chart_helper.pyx, used when the Cython extension can
+neither be imported nor compiled. decode and decode_packed take the same
+arguments and return the same values as their chart_helper counterparts;
+the chart is filled one span length at a time, with all the spans of a
+length scored together, using the same float32 arithmetic and the same
+tie-breaking (the first of equally good labels or splits wins).
+
+If numba is installed, numba_decoder fills the chart with the same loops
+as chart_helper.pyx, compiled by numba, instead (numpy_decoder and
+numba_decoder both have decode and decode_packed methods).
+check_chart_decoders.py compares all the decoders with each other.
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+ORACLE_PRECOMPUTED_TABLE = {}
+
+def get_oracle_charts(sentence_len, gold, label_vocab):
+    if gold in ORACLE_PRECOMPUTED_TABLE:
+        return ORACLE_PRECOMPUTED_TABLE[gold]
+
+    oracle_label_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
+    oracle_split_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
+    for length in range(1, sentence_len + 1):
+        for left in range(0, sentence_len + 1 - length):
+            right = left + length
+            oracle_label_chart[left, right] = label_vocab.index(gold.oracle_label(left, right))
+            if length == 1:
+                continue
+            oracle_splits = gold.oracle_splits(left, right)
+            oracle_split_chart[left, right] = min(oracle_splits)
+    if not gold.nocache:
+        ORACLE_PRECOMPUTED_TABLE[gold] = oracle_label_chart, oracle_split_chart
+    return oracle_label_chart, oracle_split_chart
+
+def fill_chart_numpy(sentence_len, force_gold, oracle_split_chart, value_chart, split_idx_chart):
+    # value_chart starts out with the best label score of every span. Spans
+    # of length one keep it as their value; longer spans are filled one
+    # length at a time, all the spans of a length at once.
+    for length in range(2, sentence_len + 1):
+        lefts = np.arange(0, sentence_len + 1 - length)
+        rights = lefts + length
+        if force_gold:
+            best_splits = oracle_split_chart[lefts, rights]
+        else:
+            splits = lefts[:, None] + np.arange(1, length)[None, :]
+            split_vals = value_chart[lefts[:, None], splits] + value_chart[splits, rights[:, None]]
+            best_splits = splits[np.arange(len(lefts)), np.argmax(split_vals, axis=1)]
+        value_chart[lefts, rights] = value_chart[lefts, rights] + value_chart[lefts, best_splits] + value_chart[best_splits, rights]
+        split_idx_chart[lefts, rights] = best_splits
+
+def fill_chart_loops(sentence_len, force_gold, oracle_split_chart, value_chart, split_idx_chart):
+    # Same as fill_chart_numpy, one span at a time as in chart_helper.pyx;
+    # only meant to be compiled by numba
+    neg_inf = np.float32(-np.inf)
+    for length in range(2, sentence_len + 1):
+        for left in range(0, sentence_len + 1 - length):
+            right = left + length
+            if force_gold:
+                best_split = oracle_split_chart[left, right]
+            else:
+                best_split = left + 1
+                split_val = neg_inf
+                for split_idx in range(left + 1, right):
+                    max_split_val = value_chart[left, split_idx] + value_chart[split_idx, right]
+                    if max_split_val > split_val:
+                        split_val = max_split_val
+                        best_split = split_idx
+            value_chart[left, right] = value_chart[left, right] + value_chart[left, best_split] + value_chart[best_split, right]
+            split_idx_chart[left, right] = best_split
+
+class ChartDecoder(object):
+    def __init__(self, fill_chart):
+        self.fill_chart = fill_chart
+
+    def decode(self, force_gold, sentence_len, label_scores_chart, is_train, gold, label_vocab):
+        span_lefts, span_rights = np.triu_indices(sentence_len + 1, 1)
+        span_label_scores = label_scores_chart[span_lefts, span_rights]
+        return self.decode_spans(force_gold, sentence_len, span_lefts, span_rights, span_label_scores, is_train, gold, label_vocab)
+
+    def decode_packed(self, force_gold, sentence_len, packed_label_scores, is_train, gold, label_vocab):
+        # packed_label_scores has one row per span (left, right) with left < right,
+        # in row-major order, i.e. (0, 1), (0, 2), ..., (0, n), (1, 2), ...
+        assert packed_label_scores.shape[0] == sentence_len * (sentence_len + 1) // 2
+        span_lefts, span_rights = np.triu_indices(sentence_len + 1, 1)
+        return self.decode_spans(force_gold, sentence_len, span_lefts, span_rights, packed_label_scores, is_train, gold, label_vocab)
+
+    def decode_spans(self, force_gold, sentence_len, span_lefts, span_rights, span_label_scores, is_train, gold, label_vocab):
+        # span_label_scores[k] holds the label scores of the span
+        # (span_lefts[k], span_rights[k]); the spans are in row-major order, so
+        # the root (0, sentence_len) comes at index sentence_len - 1
+        num_spans = len(span_lefts)
+        root = sentence_len - 1
+
+        if is_train or force_gold:
+            oracle_label_chart, oracle_split_chart = get_oracle_charts(sentence_len, gold, label_vocab)
+            span_oracle_labels = oracle_label_chart[span_lefts, span_rights]
+
+        # Best label of every span, which does not depend on the rest of the chart
+        if force_gold:
+            span_best_labels = span_oracle_labels
+            span_best_label_scores = span_label_scores[np.arange(num_spans), span_oracle_labels]
+        else:
+            label_scores = span_label_scores
+            if is_train:
+                # augment: here we subtract 1 from the oracle label
+                label_scores = label_scores.copy()
+                label_scores[np.arange(num_spans), span_oracle_labels] -= np.float32(1)
+            span_best_labels = np.argmax(label_scores, axis=1)
+            # Not-a-span label is not allowed at the root of the tree
+            span_best_labels[root] = np.argmax(label_scores[root, 1:]) + 1
+            span_best_label_scores = label_scores[np.arange(num_spans), span_best_labels]
+            if is_train:
+                # augment: here we add 1 to all label scores
+                span_best_label_scores = span_best_label_scores + np.float32(1)
+
+        best_label_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
+        best_label_chart[span_lefts, span_rights] = span_best_labels
+        value_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.float32)
+        value_chart[span_lefts, span_rights] = span_best_label_scores
+        split_idx_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
+        if not force_gold:
+            oracle_split_chart = split_idx_chart
+
+        self.fill_chart(sentence_len, bool(force_gold), oracle_split_chart, value_chart, split_idx_chart)
+
+        # Recover the tree, in preorder, by traversing the chart from the root
+        num_tree_nodes = 2 * sentence_len - 1
+        included_i = np.empty(num_tree_nodes, dtype=int)
+        included_j = np.empty(num_tree_nodes, dtype=int)
+        idx = 0
+        stack = [(0, sentence_len)]
+        while stack:
+            i, j = stack.pop()
+            included_i[idx] = i
+            included_j[idx] = j
+            idx += 1
+            if i + 1 < j:
+                k = split_idx_chart[i, j]
+                stack.append((k, j))
+                stack.append((i, k))
+        included_label = best_label_chart[included_i, included_j].astype(int)
+
+        # The score of the tree without the augmentation, summed in order in float32
+        span_indices = included_i * sentence_len - included_i * (included_i - 1) // 2 + (included_j - included_i - 1)
+        running_total = np.cumsum(span_label_scores[span_indices, included_label], dtype=np.float32)[-1]
+
+        score = value_chart[0, sentence_len]
+        augment_amount = np.float32(round(float(score - running_total)))
+
+        return float(score), included_i, included_j, included_label, float(augment_amount)
+
+numpy_decoder = ChartDecoder(fill_chart_numpy)
+
+if numba is not None:
+    numba_decoder = ChartDecoder(numba.njit(cache=True)(fill_chart_loops))
+else:
+    numba_decoder = None
+
+decode = numpy_decoder.decode
+decode_packed = numpy_decoder.decode_packed
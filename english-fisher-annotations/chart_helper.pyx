@@ -2,32 +2,36 @@ import numpy as np
 cimport numpy as np
 from numpy cimport ndarray
 cimport cython
+from libc.math cimport INFINITY
 
 ctypedef np.float32_t DTYPE_t
 
 ORACLE_PRECOMPUTED_TABLE = {}
 
-@cython.boundscheck(False)
-def decode(int force_gold, int sentence_len, np.ndarray[DTYPE_t, ndim=3] label_scores_chart, int is_train, gold, label_vocab):
-    cdef DTYPE_t NEG_INF = -np.inf
+cdef inline int span_row(int left, int right, int num_fenceposts, int packed) noexcept nogil:
+    # Row of span (left, right) in the label scores, which are either a full
+    # (num_fenceposts * num_fenceposts, labels) chart, or packed to hold only
+    # the spans with left < right, in row-major order
+    if packed:
+        return left * num_fenceposts - left * (left + 1) // 2 + (right - left - 1)
+    return left * num_fenceposts + right
 
-    # Label scores chart is copied so we can modify it in-place for augmentated decode
-    cdef np.ndarray[DTYPE_t, ndim=3] label_scores_chart_copy = label_scores_chart.copy()
-    cdef np.ndarray[DTYPE_t, ndim=2] value_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.float32)
-    cdef np.ndarray[int, ndim=2] split_idx_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
-    cdef np.ndarray[int, ndim=2] best_label_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void fill_charts(int force_gold, int sentence_len, DTYPE_t[:, ::1] label_scores_copy, int packed, int is_train,
+                      int[:, ::1] oracle_label_chart, int[:, ::1] oracle_split_chart,
+                      DTYPE_t[:, ::1] value_chart, int[:, ::1] split_idx_chart, int[:, ::1] best_label_chart) noexcept nogil:
+    cdef DTYPE_t NEG_INF = -INFINITY
+    cdef int num_labels = label_scores_copy.shape[1]
+    cdef int row
 
     cdef int length
     cdef int left
     cdef int right
 
-    cdef np.ndarray[DTYPE_t, ndim=1] label_scores_for_span
-
-    cdef int oracle_label_index
+    cdef int oracle_label_index = 0
     cdef DTYPE_t label_score
     cdef int argmax_label_index
-    cdef DTYPE_t left_score
-    cdef DTYPE_t right_score
 
     cdef int best_split
     cdef int split_idx # Loop variable for splitting
@@ -36,40 +40,22 @@ def decode(int force_gold, int sentence_len, np.ndarray[DTYPE_t, ndim=3] label_s
 
     cdef int label_index_iter
 
-    cdef np.ndarray[int, ndim=2] oracle_label_chart
-    cdef np.ndarray[int, ndim=2] oracle_split_chart
-    if is_train or force_gold:
-        if gold not in ORACLE_PRECOMPUTED_TABLE:
-            oracle_label_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
-            oracle_split_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
-            for length in range(1, sentence_len + 1):
-                for left in range(0, sentence_len + 1 - length):
-                    right = left + length
-                    oracle_label_chart[left, right] = label_vocab.index(gold.oracle_label(left, right))
-                    if length == 1:
-                        continue
-                    oracle_splits = gold.oracle_splits(left, right)
-                    oracle_split_chart[left, right] = min(oracle_splits)
-            if not gold.nocache:
-                ORACLE_PRECOMPUTED_TABLE[gold] = oracle_label_chart, oracle_split_chart
-        else:
-            oracle_label_chart, oracle_split_chart = ORACLE_PRECOMPUTED_TABLE[gold]
-
     for length in range(1, sentence_len + 1):
         for left in range(0, sentence_len + 1 - length):
             right = left + length
+            row = span_row(left, right, sentence_len + 1, packed)
 
             if is_train or force_gold:
                 oracle_label_index = oracle_label_chart[left, right]
 
             if force_gold:
-                label_score = label_scores_chart_copy[left, right, oracle_label_index]
+                label_score = label_scores_copy[row, oracle_label_index]
                 best_label_chart[left, right] = oracle_label_index
 
             else:
                 if is_train:
                     # augment: here we subtract 1 from the oracle label
-                    label_scores_chart_copy[left, right, oracle_label_index] -= 1
+                    label_scores_copy[row, oracle_label_index] -= 1
 
                 # We do argmax ourselves to make sure it compiles to pure C
                 if length < sentence_len:
@@ -78,11 +64,11 @@ def decode(int force_gold, int sentence_len, np.ndarray[DTYPE_t, ndim=3] label_s
                     # Not-a-span label is not allowed at the root of the tree
                     argmax_label_index = 1
 
-                label_score = label_scores_chart_copy[left, right, argmax_label_index]
-                for label_index_iter in range(1, label_scores_chart_copy.shape[2]):
-                    if label_scores_chart_copy[left, right, label_index_iter] > label_score:
+                label_score = label_scores_copy[row, argmax_label_index]
+                for label_index_iter in range(1, num_labels):
+                    if label_scores_copy[row, label_index_iter] > label_score:
                         argmax_label_index = label_index_iter
-                        label_score = label_scores_chart_copy[left, right, label_index_iter]
+                        label_score = label_scores_copy[row, label_index_iter]
                 best_label_chart[left, right] = argmax_label_index
 
                 if is_train:
@@ -107,21 +93,16 @@ def decode(int force_gold, int sentence_len, np.ndarray[DTYPE_t, ndim=3] label_s
             value_chart[left, right] = label_score + value_chart[left, best_split] + value_chart[best_split, right]
             split_idx_chart[left, right] = best_split
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void recover_tree(int sentence_len, int[:, ::1] split_idx_chart, int[:, ::1] best_label_chart,
+                       int[::1] included_i, int[::1] included_j, int[::1] included_label,
+                       int[::1] stack_i, int[::1] stack_j) noexcept nogil:
     # Now we need to recover the tree by traversing the chart starting at the
     # root. This iterative implementation is faster than any of my attempts to
     # use helper functions and recursion
-
-    # All fully binarized trees have the same number of nodes
-    cdef int num_tree_nodes = 2 * sentence_len - 1
-    cdef np.ndarray[int, ndim=1] included_i = np.empty(num_tree_nodes, dtype=np.int32)
-    cdef np.ndarray[int, ndim=1] included_j = np.empty(num_tree_nodes, dtype=np.int32)
-    cdef np.ndarray[int, ndim=1] included_label = np.empty(num_tree_nodes, dtype=np.int32)
-
     cdef int idx = 0
     cdef int stack_idx = 1
-    # technically, the maximum stack depth is smaller than this
-    cdef np.ndarray[int, ndim=1] stack_i = np.empty(num_tree_nodes + 5, dtype=np.int32)
-    cdef np.ndarray[int, ndim=1] stack_j = np.empty(num_tree_nodes + 5, dtype=np.int32)
     stack_i[1] = 0
     stack_j[1] = sentence_len
 
@@ -143,9 +124,98 @@ def decode(int force_gold, int sentence_len, np.ndarray[DTYPE_t, ndim=3] label_s
             stack_i[stack_idx] = i
             stack_j[stack_idx] = k
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef DTYPE_t tree_label_score(DTYPE_t[:, :] label_scores, int packed, int sentence_len, int num_tree_nodes,
+                              int[::1] included_i, int[::1] included_j, int[::1] included_label) noexcept nogil:
     cdef DTYPE_t running_total = 0.0
+    cdef int idx
     for idx in range(num_tree_nodes):
-        running_total += label_scores_chart[included_i[idx], included_j[idx], included_label[idx]]
+        running_total += label_scores[span_row(included_i[idx], included_j[idx], sentence_len + 1, packed), included_label[idx]]
+    return running_total
+
+def decode(int force_gold, int sentence_len, np.ndarray[DTYPE_t, ndim=3] label_scores_chart, int is_train, gold, label_vocab):
+    num_fenceposts = sentence_len + 1
+    label_scores = label_scores_chart[:num_fenceposts, :num_fenceposts].reshape(num_fenceposts * num_fenceposts, -1)
+    return decode_label_scores(force_gold, sentence_len, label_scores, False, is_train, gold, label_vocab)
+
+def decode_packed(int force_gold, int sentence_len, np.ndarray[DTYPE_t, ndim=2] packed_label_scores, int is_train, gold, label_vocab):
+    # packed_label_scores has one row per span (left, right) with left < right,
+    # in row-major order, i.e. (0, 1), (0, 2), ..., (0, n), (1, 2), ...
+    assert packed_label_scores.shape[0] == sentence_len * (sentence_len + 1) // 2
+    return decode_label_scores(force_gold, sentence_len, packed_label_scores, True, is_train, gold, label_vocab)
+
+def decode_label_scores(int force_gold, int sentence_len, np.ndarray[DTYPE_t, ndim=2] label_scores, int packed, int is_train, gold, label_vocab):
+    # The chart is filled and the tree recovered without holding the GIL, so
+    # that several sentences can be decoded in parallel threads. Everything
+    # that touches Python objects (the gold tree and label vocab for the
+    # oracle) happens here beforehand.
+
+    # Label scores are copied so we can modify them in-place for augmentated decode
+    cdef np.ndarray[DTYPE_t, ndim=2] label_scores_copy = np.ascontiguousarray(label_scores).copy()
+    cdef np.ndarray[DTYPE_t, ndim=2] value_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.float32)
+    cdef np.ndarray[int, ndim=2] split_idx_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
+    cdef np.ndarray[int, ndim=2] best_label_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
+
+    cdef int length
+    cdef int left
+    cdef int right
+
+    cdef np.ndarray[int, ndim=2] oracle_label_chart
+    cdef np.ndarray[int, ndim=2] oracle_split_chart
+    if is_train or force_gold:
+        if gold not in ORACLE_PRECOMPUTED_TABLE:
+            oracle_label_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
+            oracle_split_chart = np.zeros((sentence_len+1, sentence_len+1), dtype=np.int32)
+            for length in range(1, sentence_len + 1):
+                for left in range(0, sentence_len + 1 - length):
+                    right = left + length
+                    oracle_label_chart[left, right] = label_vocab.index(gold.oracle_label(left, right))
+                    if length == 1:
+                        continue
+                    oracle_splits = gold.oracle_splits(left, right)
+                    oracle_split_chart[left, right] = min(oracle_splits)
+            if not gold.nocache:
+                ORACLE_PRECOMPUTED_TABLE[gold] = oracle_label_chart, oracle_split_chart
+        else:
+            oracle_label_chart, oracle_split_chart = ORACLE_PRECOMPUTED_TABLE[gold]
+    else:
+        # unused
+        oracle_label_chart = np.zeros((1, 1), dtype=np.int32)
+        oracle_split_chart = oracle_label_chart
+
+    # All fully binarized trees have the same number of nodes
+    cdef int num_tree_nodes = 2 * sentence_len - 1
+    cdef np.ndarray[int, ndim=1] included_i = np.empty(num_tree_nodes, dtype=np.int32)
+    cdef np.ndarray[int, ndim=1] included_j = np.empty(num_tree_nodes, dtype=np.int32)
+    cdef np.ndarray[int, ndim=1] included_label = np.empty(num_tree_nodes, dtype=np.int32)
+
+    # technically, the maximum stack depth is smaller than this
+    cdef np.ndarray[int, ndim=1] stack_i = np.empty(num_tree_nodes + 5, dtype=np.int32)
+    cdef np.ndarray[int, ndim=1] stack_j = np.empty(num_tree_nodes + 5, dtype=np.int32)
+
+    cdef DTYPE_t[:, ::1] label_scores_copy_view = label_scores_copy
+    cdef DTYPE_t[:, :] label_scores_view = label_scores
+    cdef int[:, ::1] oracle_label_chart_view = oracle_label_chart
+    cdef int[:, ::1] oracle_split_chart_view = oracle_split_chart
+    cdef DTYPE_t[:, ::1] value_chart_view = value_chart
+    cdef int[:, ::1] split_idx_chart_view = split_idx_chart
+    cdef int[:, ::1] best_label_chart_view = best_label_chart
+    cdef int[::1] included_i_view = included_i
+    cdef int[::1] included_j_view = included_j
+    cdef int[::1] included_label_view = included_label
+    cdef int[::1] stack_i_view = stack_i
+    cdef int[::1] stack_j_view = stack_j
+
+    cdef DTYPE_t running_total
+    with nogil:
+        fill_charts(force_gold, sentence_len, label_scores_copy_view, packed, is_train,
+                    oracle_label_chart_view, oracle_split_chart_view,
+                    value_chart_view, split_idx_chart_view, best_label_chart_view)
+        recover_tree(sentence_len, split_idx_chart_view, best_label_chart_view,
+                     included_i_view, included_j_view, included_label_view, stack_i_view, stack_j_view)
+        running_total = tree_label_score(label_scores_view, packed, sentence_len, num_tree_nodes,
+                                         included_i_view, included_j_view, included_label_view)
 
     cdef DTYPE_t score = value_chart[0, sentence_len]
     cdef DTYPE_t augment_amount = round(score - running_total)
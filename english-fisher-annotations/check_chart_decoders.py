@@ -0,0 +1,148 @@
+"""
+Checks that every available CKY decoder (chart_helper.pyx, and the numba
+and NumPy decoders of chart_decoder.py) returns exactly the same results
+on random charts, and times them, e.g.
+
+python check_chart_decoders.py --num-charts 500 --benchmark-lengths 10 40 100 300
+
+The charts cover full and packed layouts, ties between labels and splits
+(with scores rounded to integers), and decoding with a gold tree
+(force_gold) and with loss augmentation (is_train).
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import parse_nk
+import trees
+import vocabulary
+
+LABELS = ["S", "NP", "VP", "EDITED", "INTJ", "PRN"]
+
+
+def random_tree(rng, left, right):
+    # a random bracketing of the words left..right-1 as a treebank string
+    if right - left == 1:
+        leaf = "(XX w{})".format(left)
+        return "({} {})".format(rng.choice(LABELS), leaf) if rng.random() < 0.3 else leaf
+    split = int(rng.integers(left + 1, right))
+    return "({} {} {})".format(rng.choice(LABELS), random_tree(rng, left, split), random_tree(rng, split, right))
+
+
+def make_label_vocab():
+    label_vocab = vocabulary.Vocabulary()
+    label_vocab.index(())
+    for label in LABELS:
+        label_vocab.index((label,))
+    for outer in LABELS:
+        for inner in LABELS:
+            label_vocab.index((outer, inner))
+    label_vocab.freeze()
+    return label_vocab
+
+
+def random_gold(rng, sentence_len):
+    # the root always needs a label
+    tree = trees.tree_from_str("(S {})".format(random_tree(rng, 0, sentence_len)), strip_top=False)
+    return tree.convert(nocache=True)
+
+
+def get_decoders():
+    decoders = {}
+    for name in ("cython", "numba", "numpy"):
+        try:
+            decoders[name] = parse_nk.load_chart_decoder(name)
+        except ImportError as e:
+            print("{} decoder not available: {}".format(name, e))
+    return decoders
+
+
+def decode_all(decoder, force_gold, sentence_len, chart, packed, is_train, gold, label_vocab):
+    if packed is not None:
+        return decoder.decode_packed(force_gold, sentence_len, packed, is_train, gold, label_vocab)
+    return decoder.decode(force_gold, sentence_len, chart, is_train, gold, label_vocab)
+
+
+def same_results(result, reference):
+    score, p_i, p_j, p_label, augment = result
+    ref_score, ref_i, ref_j, ref_label, ref_augment = reference
+    return (score == ref_score and augment == ref_augment
+            and np.array_equal(p_i, ref_i) and np.array_equal(p_j, ref_j) and np.array_equal(p_label, ref_label))
+
+
+def check_parity(decoders, label_vocab, num_charts, max_len, seed):
+    rng = np.random.default_rng(seed)
+    names = list(decoders)
+    reference_name = names[0]
+    num_checked = 0
+    mismatches = []
+    for chart_idx in range(num_charts):
+        sentence_len = int(rng.integers(1, max_len + 1))
+        chart = rng.standard_normal((sentence_len + 1, sentence_len + 1, label_vocab.size)).astype(np.float32)
+        if chart_idx % 2 == 0:
+            chart = np.round(chart)
+        span_lefts, span_rights = np.triu_indices(sentence_len + 1, 1)
+        packed = np.ascontiguousarray(chart[span_lefts, span_rights])
+        gold = random_gold(rng, sentence_len)
+
+        for force_gold, is_train in ((False, False), (True, False), (False, True), (True, True)):
+            for layout in ("full", "packed"):
+                layout_packed = packed if layout == "packed" else None
+                run_gold = gold if (force_gold or is_train) else None
+                reference = decode_all(decoders[reference_name], force_gold, sentence_len, chart, layout_packed, is_train, run_gold, label_vocab)
+                for name in names[1:]:
+                    result = decode_all(decoders[name], force_gold, sentence_len, chart, layout_packed, is_train, run_gold, label_vocab)
+                    num_checked += 1
+                    if not same_results(result, reference):
+                        mismatches.append((name, chart_idx, sentence_len, layout, force_gold, is_train))
+
+    print("Compared {} decodes against {}: {} mismatches".format(num_checked, reference_name, len(mismatches)))
+    for mismatch in mismatches[:10]:
+        print("  {} differs on chart {} (length {}, {}, force_gold={}, is_train={})".format(*mismatch))
+    return not mismatches
+
+
+def benchmark(decoders, label_vocab, lengths, repeat, seed):
+    rng = np.random.default_rng(seed)
+    print()
+    print("milliseconds per (packed) decode")
+    print("{:<8}".format("length") + "".join("{:>10}".format(name) for name in decoders))
+    for sentence_len in lengths:
+        span_lefts, span_rights = np.triu_indices(sentence_len + 1, 1)
+        packed = rng.standard_normal((len(span_lefts), label_vocab.size)).astype(np.float32)
+        row = "{:<8}".format(sentence_len)
+        for decoder in decoders.values():
+            # the first call includes compiling, for numba
+            decoder.decode_packed(False, sentence_len, packed, False, None, label_vocab)
+            start_time = time.perf_counter()
+            for _ in range(repeat):
+                decoder.decode_packed(False, sentence_len, packed, False, None, label_vocab)
+            row += "{:>10.3f}".format((time.perf_counter() - start_time) / repeat * 1000)
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-charts", type=int, default=300)
+    parser.add_argument("--max-len", type=int, default=30, help="Maximum sentence length of the parity check charts.")
+    parser.add_argument("--benchmark-lengths", type=int, nargs="*", default=[10, 40, 100, 300])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    decoders = get_decoders()
+    label_vocab = make_label_vocab()
+    if len(decoders) > 1:
+        ok = check_parity(decoders, label_vocab, args.num_charts, args.max_len, args.seed)
+    else:
+        ok = True
+        print("Only one decoder available, nothing to compare")
+    if args.benchmark_lengths:
+        benchmark(decoders, label_vocab, args.benchmark_lengths, args.repeat, args.seed)
+    if not ok:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
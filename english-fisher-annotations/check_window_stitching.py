@@ -0,0 +1,90 @@
+"""
+Checks how the parses of the windows of a long sentence are stitched
+together (main.py --long-sentences window), without a model, e.g.
+
+python check_window_stitching.py --num-sentences 500
+
+Each window is given the parse of the whole sentence, cut down to the
+window, so the stitched parse must give every word the same orig_dys
+and dys labels as the parse of the whole sentence, including the words
+of a constituent that crosses the boundary between two windows' cores.
+"""
+
+import argparse
+
+import numpy as np
+
+import fisher_annotator
+import trees
+
+LABELS = ["S", "NP", "VP", "EDITED", "INTJ", "PRN"]
+
+
+def random_spans(rng, left, right, starts, ends, labels):
+    # a random tree over the words left..right-1, as spans in preorder
+    label = tuple(rng.choice(LABELS, size=int(rng.integers(0, 3))))
+    starts.append(left)
+    ends.append(right)
+    labels.append(label)
+    if right - left > 1:
+        split = int(rng.integers(left + 1, right))
+        random_spans(rng, left, split, starts, ends, labels)
+        random_spans(rng, split, right, starts, ends, labels)
+
+
+def window_parse(span_parse, start, end):
+    # the spans of span_parse clipped to the window words[start:end], as if the
+    # window had been parsed on its own (the root keeps the sentence's root labels)
+    starts, ends, labels = [0], [end - start], [span_parse.labels[0]]
+    for span_start, span_end, label in zip(span_parse.starts[1:], span_parse.ends[1:], span_parse.labels[1:]):
+        span_start, span_end = max(span_start, start), min(span_end, end)
+        if span_start < span_end:
+            starts.append(span_start - start)
+            ends.append(span_end - start)
+            labels.append(label)
+    return trees.SpanParse(span_parse.sentence[start:end], starts, ends, labels)
+
+
+def check(span_parse, windows):
+    stitched = fisher_annotator.stitch_span_parses(
+        span_parse.sentence,
+        windows,
+        [window_parse(span_parse, start, end) for start, end, _, _ in windows],
+        )
+    # the stitched spans must still form a tree over the whole sentence
+    tree = trees.tree_from_str(stitched.linearize(), strip_top=False)
+    assert [leaf.word for leaf in tree.leaves()] == [word for _, word in span_parse.sentence]
+    return fisher_annotator.DisfluencyTagger.label_spans(stitched) == fisher_annotator.DisfluencyTagger.label_spans(span_parse)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-sentences", type=int, default=300)
+    parser.add_argument("--max-len", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # EDITED over words 15-18, across the boundary (17) between the two windows' cores
+    sentence = [("XX", "w{}".format(i)) for i in range(30)]
+    crossing = trees.SpanParse(sentence, [0, 15], [30, 19], [("S",), ("EDITED",)])
+    assert check(crossing, [(0, 20, 0, 17), (14, 30, 17, 30)]), "a span crossing a core boundary lost its labels"
+
+    rng = np.random.default_rng(args.seed)
+    num_failed = 0
+    for _ in range(args.num_sentences):
+        sentence_len = int(rng.integers(2, args.max_len + 1))
+        sentence = [("XX", "w{}".format(i)) for i in range(sentence_len)]
+        starts, ends, labels = [], [], []
+        random_spans(rng, 0, sentence_len, starts, ends, labels)
+        labels[0] = ("S",) + labels[0]
+        window_size = int(rng.integers(2, sentence_len + 1))
+        overlap = int(rng.integers(0, window_size))
+        windows = fisher_annotator.get_windows(sentence_len, window_size, overlap)
+        num_failed += not check(trees.SpanParse(sentence, starts, ends, labels), windows)
+
+    print("{} of {} random sentences stitched differently from the whole sentence's parse".format(num_failed, args.num_sentences))
+    if num_failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Compares the annotations and the speed of the fp32 model against the int8
+dynamically quantized one (main.py --quantize dynamic) on the small-scale
+transcripts, e.g.
+
+python compare_quantization.py --csv-path ../csv/small_scale_texts.csv --column GroundTruth-min
+
+The int8 parse trees are scored against the fp32 ones with labelled bracket
+F1 (every bracket counts, including the root; no EVALB parameter file), and
+the disfluency labels with the number of words tagged "E" in each.
+"""
+
+import argparse
+import collections
+import time
+
+import pandas as pd
+import torch
+
+import fisher_annotator
+import trees
+
+
+def get_brackets(linear_tree):
+    brackets = collections.Counter()
+    stack = [trees.tree_from_str(linear_tree, strip_top=False).convert()]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, trees.InternalParseNode):
+            for label in node.label:
+                brackets[(label, node.left, node.right)] += 1
+            stack.extend(node.children)
+    return brackets
+
+
+def annotate(texts, model, quantize, subbatch_max_tokens):
+    annotator = fisher_annotator.Annotate(model=model, quantize=quantize, subbatch_max_tokens=subbatch_max_tokens)
+
+    start_time = time.time()
+    annotator.load_parser()
+    load_time = time.time() - start_time
+
+    start_time = time.time()
+    results = [annotator.annotate_text(text) for text in texts]
+    annotate_time = time.time() - start_time
+
+    return results, load_time, annotate_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv-path", type=str, default="../csv/small_scale_texts.csv")
+    parser.add_argument("--column", type=str, default="GroundTruth-min", help="Column of the csv holding the transcripts.")
+    parser.add_argument("--model", type=str, default="./model/swbd_fisher_bert_Edev.0.9078.pt")
+    parser.add_argument("--subbatch-max-tokens", type=int, default=3000)
+    parser.add_argument("--limit", type=int, help="Only use the first LIMIT transcripts.")
+    parser.add_argument("--threads", type=int, help="torch threads (default: torch's own default).")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    df = pd.read_csv(args.csv_path, index_col=0)
+    texts = [str(text) for text in df[args.column].dropna() if str(text).strip()]
+    if args.limit:
+        texts = texts[:args.limit]
+    num_words = sum(len(text.split()) for text in texts)
+    print("{} transcripts, {} words, {} torch threads".format(len(texts), num_words, torch.get_num_threads()))
+
+    fp32_results, fp32_load_time, fp32_time = annotate(texts, args.model, None, args.subbatch_max_tokens)
+    int8_results, int8_load_time, int8_time = annotate(texts, args.model, "dynamic", args.subbatch_max_tokens)
+
+    print()
+    print("{:<8} {:>10} {:>12} {:>12}".format("", "load (s)", "annotate (s)", "words/s"))
+    print("{:<8} {:>10.2f} {:>12.2f} {:>12.1f}".format("fp32", fp32_load_time, fp32_time, num_words / fp32_time))
+    print("{:<8} {:>10.2f} {:>12.2f} {:>12.1f}".format("int8", int8_load_time, int8_time, num_words / int8_time))
+    print("speedup: {:.2f}x".format(fp32_time / int8_time))
+
+    matched = fp32_total = int8_total = 0
+    label_counts = {"fp32": collections.Counter(), "int8": collections.Counter()}
+    tag_counts = {"fp32": collections.Counter(), "int8": collections.Counter()}
+    tags_agree = tags_total = 0
+    for fp32_result, int8_result in zip(fp32_results, int8_results):
+        for fp32_tree, int8_tree in zip(fp32_result.parse.splitlines(), int8_result.parse.splitlines()):
+            fp32_brackets = get_brackets(fp32_tree)
+            int8_brackets = get_brackets(int8_tree)
+            matched += sum((fp32_brackets & int8_brackets).values())
+            fp32_total += sum(fp32_brackets.values())
+            int8_total += sum(int8_brackets.values())
+            for name, brackets in (("fp32", fp32_brackets), ("int8", int8_brackets)):
+                for (label, _, _), count in brackets.items():
+                    label_counts[name][label] += count
+
+        for name, result in (("fp32", fp32_result), ("int8", int8_result)):
+            tag_counts[name]["orig_dys"] += result.orig_dys.split()[1::2].count("E")
+            tag_counts[name]["dys"] += result.dys.split()[1::2].count("E")
+        fp32_tags = fp32_result.dys.split()[1::2]
+        int8_tags = int8_result.dys.split()[1::2]
+        tags_agree += sum(fp32_tag == int8_tag for fp32_tag, int8_tag in zip(fp32_tags, int8_tags))
+        tags_total += len(fp32_tags)
+
+    precision = matched / int8_total if int8_total else 0.0
+    recall = matched / fp32_total if fp32_total else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    print()
+    print("int8 vs fp32 parses: precision {:.4f} recall {:.4f} F1 {:.4f}".format(precision, recall, f1))
+    print("int8 vs fp32 dys tags: {:.4f} of {} words agree".format(tags_agree / tags_total if tags_total else 0.0, tags_total))
+
+    print()
+    print("{:<12} {:>8} {:>8}".format("", "fp32", "int8"))
+    for label in fisher_annotator.DisfluencyTagger.disfluent_labels:
+        print("{:<12} {:>8} {:>8}".format(label, label_counts["fp32"][label], label_counts["int8"][label]))
+    for name in ("orig_dys", "dys"):
+        print("{:<12} {:>8} {:>8}".format(name + " E", tag_counts["fp32"][name], tag_counts["int8"][name]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+Exports a parser model into a single self-contained file, which includes
+the BERT tokenizer and config, e.g.
+
+python export_model.py --model ./model/swbd_fisher_bert_Edev.0.9078.pt --output-path ./model/swbd_fisher_bert_Edev.0.9078.export.pt
+
+and can be used in place of the original model (main.py --model ...).
+Loading it does not need the BERT files in ./model, the weights are
+memory-mapped instead of read into memory (torch >= 2.1), and they are not
+randomly initialized before being overwritten, so the annotator starts up
+much faster, and processes annotating with the same file share its weights.
+"""
+
+import argparse
+import time
+
+import torch
+
+import fisher_annotator
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default="./model/swbd_fisher_bert_Edev.0.9078.pt")
+    parser.add_argument("--output-path", type=str, required=True)
+    args = parser.parse_args()
+
+    artifact = fisher_annotator.Annotate(model=args.model).load_parser().to_artifact()
+    # the zip format (the default since torch 1.6) is what allows memory-mapping
+    torch.save(artifact, args.output_path)
+
+    start_time = time.time()
+    fisher_annotator.Annotate(model=args.output_path).load_parser()
+    print("Exported to {} (loads in {:.2f}s)".format(args.output_path, time.time() - start_time))
+
+if __name__ == "__main__":
+    main()
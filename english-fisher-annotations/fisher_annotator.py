@@ -14,12 +14,18 @@ https://www.aclweb.org/anthology/2020.acl-main.346.pdf
 """
 
 import codecs
+import collections
 import fnmatch
+import functools
+import inspect
+import multiprocessing
 import os
 import re   
-import torch
+import zipfile
 
-import parse_nk
+# torch and parse_nk are only imported when a model is loaded, 
+# so that importing this module (or utils_trees) stays cheap
+import trees
 
 import shutil
 
@@ -36,6 +42,24 @@ import traceback
 import logging
 
 
+# The annotations of a single transcript; each field holds the contents 
+# of the corresponding *_parse.txt, *_orig_dys.txt or *_dys.txt file
+AnnotationResult = collections.namedtuple("AnnotationResult", ["parse", "orig_dys", "dys"])
+
+
+# The annotator whose model is used by the worker processes. It is set 
+# just before the workers are forked, so each worker inherits the 
+# already-loaded model instead of loading its own copy.
+_worker_annotator = None
+
+def _init_worker(num_threads):
+    import torch
+    torch.set_num_threads(num_threads)
+
+def _parse_subbatch_in_worker(subbatch):
+    return _worker_annotator.parse_subbatch(*subbatch)
+
+
 class DisfluencyTagger:
     """
     This class is called when self.disfluency==True.    
@@ -47,41 +71,67 @@ class DisfluencyTagger:
             word is disfluent and "_" shows that 
             the previous word is fluent.
     """
+    # labels of the nodes whose words are tagged as disfluent in *_dys.txt; 
+    # *_orig_dys.txt only uses EDITED
+    disfluent_labels = ("EDITED", "INTJ", "PRN")
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
  
     @staticmethod
-    def fluent(tokens):
-        leaves_tags = [t.replace(")","")+" _" for t in tokens if ")" in t]      
-        return " ".join(leaves_tags)
+    def label_tree(tree):
+        """
+        Walks a predicted trees.InternalParseNode once, returning 
+        both its EDITED-only (orig_dys) and its EDITED/INTJ/PRN 
+        (dys) labels.
+        """
+        orig_dys_tags, dys_tags = [], []
+        # a node's label is a tuple for a chain of unary nodes; the 
+        # outermost label of the root itself is never checked
+        stack = [(tree, tree.label[1:], False, False)]
+        while stack:
+            node, labels, edited, disfluent = stack.pop()
+            if isinstance(node, trees.LeafParseNode):
+                orig_dys_tags.append(node.word + (" E" if edited else " _"))
+                dys_tags.append(node.word + (" E" if disfluent else " _"))
+                continue
+            # disfluencies are dominated by EDITED nodes in parse trees
+            edited = edited or "EDITED" in labels
+            disfluent = disfluent or any(label in DisfluencyTagger.disfluent_labels for label in labels)
+            for child in reversed(node.children):
+                stack.append((child, getattr(child, "label", ()), edited, disfluent))
+        return " ".join(orig_dys_tags), " ".join(dys_tags)
 
     @staticmethod
-    def disfluent(tokens):
-        # remove first and last brackets
-        tokens, tokens[-1] = tokens[1:], tokens[-1][:-1]
-        open_bracket, close_bracket, pointer = 0, 0, 0      
-        df_region = False
-        tags = []
-        while pointer < len(tokens):
-            open_bracket += tokens[pointer].count("(")                
-            close_bracket += tokens[pointer].count(")")
-            if "(EDITED" in tokens[pointer]:  
-                open_bracket, close_bracket = 1, 0             
-                df_region = True
-            elif ")" in tokens[pointer]:
-                label = "E" if df_region else "_"  
-                tags.append(
-                    (tokens[pointer].replace(")", ""), label)
-                    )                 
-            if all(
-                (close_bracket,
-                open_bracket == close_bracket)
-                ):
-                open_bracket, close_bracket = 0, 0
-                df_region = False            
-
-            pointer += 1
-        return " ".join(list(map(lambda t: " ".join(t), tags)))
+    def label_spans(span_parse):
+        """
+        Same as label_tree, for a predicted trees.SpanParse: 
+        a word is disfluent if any span covering it has a 
+        disfluent label.
+        """
+        num_words = len(span_parse.sentence)
+        # +1 at the start and -1 at the end of each (EDITED/disfluent) span
+        edited_changes = [0] * (num_words + 1)
+        disfluent_changes = [0] * (num_words + 1)
+        for span_index, (start, end, labels) in enumerate(zip(span_parse.starts, span_parse.ends, span_parse.labels)):
+            if span_index == 0:
+                # the root
+                labels = labels[1:]
+            if "EDITED" in labels:
+                edited_changes[start] += 1
+                edited_changes[end] -= 1
+            if any(label in DisfluencyTagger.disfluent_labels for label in labels):
+                disfluent_changes[start] += 1
+                disfluent_changes[end] -= 1
+
+        orig_dys_tags, dys_tags = [], []
+        edited_depth = disfluent_depth = 0
+        for (_, word), edited_change, disfluent_change in zip(span_parse.sentence, edited_changes, disfluent_changes):
+            edited_depth += edited_change
+            disfluent_depth += disfluent_change
+            orig_dys_tags.append(word + (" E" if edited_depth else " _"))
+            dys_tags.append(word + (" E" if disfluent_depth else " _"))
+        return " ".join(orig_dys_tags), " ".join(dys_tags)
 
 
 class Parser(DisfluencyTagger):
@@ -91,32 +141,78 @@ class Parser(DisfluencyTagger):
     Returns:
         Parsed and disfluency labelled transcripts
     """
+    # the loaded NKChartParser, shared by every call to run_parser
+    chart_parser = None
+    # the pool of worker processes used when self.workers > 1
+    worker_pool = None
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
     def torch_load(self):
+        import torch
+        import parse_nk
+
+        load_kwargs = {}
+        load_parameters = inspect.signature(torch.load).parameters
+        # the model files hold pickled vocabularies (and exported 
+        # models the BERT tokenizer), not only tensors
+        if "weights_only" in load_parameters:
+            load_kwargs["weights_only"] = False
+        # files in the zip format (e.g. written by export_model.py) are 
+        # memory-mapped, so that processes loading the same model share 
+        # its weights through the page cache
+        if "mmap" in load_parameters and zipfile.is_zipfile(self.model):
+            load_kwargs["mmap"] = True
+
         if parse_nk.use_cuda:
             return torch.load(
-                self.model
+                self.model, 
+                **load_kwargs
                 )
         else:
             return torch.load(
                 self.model, 
                 map_location=lambda storage, 
                 location: storage,
+                **load_kwargs
                 )
 
-    def run_parser(self, input_sentences):
-        eval_batch_size = 1
-        # print("Loading model from {}...".format(self.model))
-        assert self.model.endswith(".pt"), "Only pytorch savefiles supported"
+    def load_parser(self):
+        # loading the model dominates the cost of annotating a single 
+        # transcript, so it is only done on the first call
+        if self.chart_parser is None:
+            import torch
+            import parse_nk
+
+            parse_nk.set_chart_decoder(self.decoder)
+
+            # print("Loading model from {}...".format(self.model))
+            assert self.model.endswith(".pt"), "Only pytorch savefiles supported"
+
+            info = self.torch_load()
+            assert "hparams" in info["spec"], "Older savefiles not supported"
+            self.chart_parser = parse_nk.NKChartParser.from_spec(
+                info["spec"], 
+                info["state_dict"],
+                bert_tokenizer=info.get("bert_tokenizer"),
+                bert_config=info.get("bert_config"),
+                )
+            if self.quantize == "dynamic":
+                # int8 weights for every nn.Linear (BERT, the encoder's 
+                # feed-forward layers and f_label); activations are 
+                # quantized on the fly
+                assert not parse_nk.use_cuda, "Quantized inference is only supported on the CPU"
+                torch.quantization.quantize_dynamic(
+                    self.chart_parser, 
+                    {torch.nn.Linear}, 
+                    dtype=torch.qint8, 
+                    inplace=True,
+                    )
+        return self.chart_parser
 
-        info = self.torch_load()
-        assert "hparams" in info["spec"], "Older savefiles not supported"
-        parser = parse_nk.NKChartParser.from_spec(
-            info["spec"], 
-            info["state_dict"],
-            )
+    def run_parser(self, input_sentences):
+        parser = self.load_parser()
 
         # print("Parsing sentences...")
         sentences = [sentence.split() for sentence in input_sentences]
@@ -125,28 +221,127 @@ class Parser(DisfluencyTagger):
             dummy_tag = "UNK"
         else:
             dummy_tag = parser.tag_vocab.value(0)
-        
-        all_predicted = []
-        for start_index in range(0, len(sentences), eval_batch_size):
-            subbatch_sentences = sentences[start_index:start_index+eval_batch_size]
-            subbatch_sentences = [[(dummy_tag, word) for word in sentence] for sentence in subbatch_sentences]
-            predicted, _ = parser.parse_batch(subbatch_sentences)
-            del _
-            all_predicted.extend([p.convert() for p in predicted])
-        
-        parse_trees, df_labels = [], []
-        for tree in all_predicted:          
-            linear_tree = tree.linearize()
-            parse_trees.append(linear_tree)
-            if self.disfluency:
-                tokens = linear_tree.split()
-                # disfluencies are dominated by EDITED nodes in parse trees
-                if "EDITED" not in linear_tree: 
-                    df_labels.append(self.fluent(tokens))
-                else:
-                    df_labels.append(self.disfluent(tokens))
+        sentences = [[(dummy_tag, word) for word in sentence] for sentence in sentences]
+
+        # sentences longer than max_sentence_words words are parsed as 
+        # overlapping windows, whose parses are stitched back together
+        sentence_windows = {}
+        if self.long_sentences == "window":
+            for index, sentence in enumerate(sentences):
+                if len(sentence) > self.max_sentence_words:
+                    sentence_windows[index] = get_windows(len(sentence), self.max_sentence_words, self.window_overlap)
+        # the index of the sentence each parsed sentence (or window) belongs to
+        sources = []
+        parsed_sentences = []
+        for index, sentence in enumerate(sentences):
+            if index in sentence_windows:
+                for start, end, _, _ in sentence_windows[index]:
+                    sources.append(index)
+                    parsed_sentences.append(sentence[start:end])
+            else:
+                sources.append(index)
+                parsed_sentences.append(sentence)
+        is_window = [index in sentence_windows for index in sources]
+
+        # split_batch sorts the sentences by (subword) length and groups them 
+        # into sub-batches of at most subbatch_max_tokens tokens; the sentence 
+        # indices are passed in place of gold trees so that the predicted 
+        # trees can be put back into the original order
+        subbatches = list(parser.split_batch(
+            parsed_sentences, 
+            list(range(len(parsed_sentences))), 
+            subbatch_max_tokens=self.subbatch_max_tokens,
+            ))
+        subbatch_args = [
+            (subbatch_sentences, [is_window[index] for index in subbatch_indices]) 
+            for subbatch_sentences, subbatch_indices in subbatches
+            ]
+        if self.workers > 1:
+            parsed_subbatches = self.get_worker_pool().imap(_parse_subbatch_in_worker, subbatch_args)
+        else:
+            parsed_subbatches = (self.parse_subbatch(*args) for args in subbatch_args)
+
+        parsed = [None] * len(parsed_sentences)
+        for (_, subbatch_indices), parsed_subbatch in zip(subbatches, parsed_subbatches):
+            for index, parsed_sentence in zip(subbatch_indices, parsed_subbatch):
+                parsed[index] = parsed_sentence
+
+        parse_trees = [None] * len(sentences)
+        df_labels = [None] * len(sentences)
+        annotated_sentences = [None] * len(sentences)
+        window_parses = collections.defaultdict(list)
+        for index, parsed_sentence in zip(sources, parsed):
+            if index in sentence_windows:
+                window_parses[index].append(parsed_sentence)
+            else:
+                parse_trees[index], df_labels[index], annotated_sentences[index] = parsed_sentence
+        for index, windows in sentence_windows.items():
+            span_parse = stitch_span_parses(sentences[index], windows, window_parses[index])
+            parse_trees[index], df_labels[index], annotated_sentences[index] = self.annotate_span_parse(span_parse)
+
+        if not self.disfluency:
+            df_labels = []
                     
-        return parse_trees, df_labels
+        return parse_trees, df_labels, annotated_sentences
+
+    def parse_subbatch(self, subbatch_sentences, subbatch_is_window=None):
+        """
+        Returns the parse tree, orig_dys and dys labels of each sentence, 
+        or its trees.SpanParse if it is a window of a longer sentence 
+        (see run_parser()).
+        """
+        parser = self.load_parser()
+        # the predicted trees are only needed as strings, so they are 
+        # built from the decoded spans without creating tree nodes
+        predicted, _ = parser.parse_batch(subbatch_sentences, make_trees=False)
+        del _
+
+        if subbatch_is_window is None:
+            subbatch_is_window = [False] * len(predicted)
+
+        parsed = []
+        for span_parse, is_window in zip(predicted, subbatch_is_window):
+            if is_window:
+                parsed.append(span_parse)
+            else:
+                parsed.append(self.annotate_span_parse(span_parse))
+
+        return parsed
+
+    def annotate_span_parse(self, span_parse):
+        linear_tree = span_parse.linearize()
+        df_label, annotated_sentence = self.label_spans(span_parse)
+        if not self.disfluency:
+            df_label = None
+        return linear_tree, df_label, annotated_sentence
+
+    def get_worker_pool(self):
+        # the workers are forked after the model is loaded, so they share 
+        # the parent's weights; share_memory() moves the weights into shared 
+        # memory, so that they stay a single copy for the lifetime of the pool
+        if self.worker_pool is None:
+            import parse_nk
+
+            global _worker_annotator
+            assert not parse_nk.use_cuda, "Worker processes are only supported for CPU inference"
+            self.load_parser().share_memory()
+            # so that the workers inherit the decoder instead of each 
+            # loading (or compiling) it again
+            parse_nk.get_chart_helper()
+            _worker_annotator = self
+            num_threads = self.threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+            self.worker_pool = multiprocessing.get_context("fork").Pool(
+                self.workers, 
+                initializer=_init_worker, 
+                initargs=(num_threads,),
+                )
+        return self.worker_pool
+
+    def close_worker_pool(self):
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool.join()
+            self.worker_pool = None
 
            
 class Annotate(Parser):   
@@ -154,109 +349,223 @@ class Annotate(Parser):
     Writes parsed and disfluency labelled transcripts into 
     *_parse.txt and *_dys.txt files, respectively.
 
+    The input and output paths are only needed by setup(); 
+    annotate_text() works on a transcript held in memory, 
+    so a single Annotate object can serve many transcripts 
+    while loading the model only once.
     """ 
     def __init__(self, **kwargs):
-        self.input_path = kwargs["input_path"]
-        self.output_path = kwargs["output_path"] 
+        self.input_path = kwargs.get("input_path")
+        self.output_path = kwargs.get("output_path")
         self.model = kwargs["model"] 
-        self.disfluency = kwargs["disfluency"] 
+        self.disfluency = kwargs.get("disfluency", True)
+        self.subbatch_max_tokens = kwargs.get("subbatch_max_tokens", 3000)
+        self.workers = kwargs.get("workers", 1)
+        self.threads_per_worker = kwargs.get("threads_per_worker")
+        # None (fp32) or "dynamic" (int8 dynamic quantization, CPU only)
+        self.quantize = kwargs.get("quantize")
+        # the CKY decoder, one of parse_nk.CHART_DECODERS
+        self.decoder = kwargs.get("decoder", "auto")
+        # sentences longer than max_sentence_words words are either cut 
+        # off there ("truncate") or parsed in windows of max_sentence_words 
+        # words, overlapping by window_overlap words ("window")
+        self.long_sentences = kwargs.get("long_sentences", "truncate")
+        self.max_sentence_words = kwargs.get("max_sentence_words", MAX_SENTENCE_WORDS)
+        self.window_overlap = kwargs.get("window_overlap", 50)
+        assert self.long_sentences in ("truncate", "window")
 
     def setup(self): 
         self.parse_sentences()
 
+    def annotate_text(self, text):
+        """
+        Annotates a single transcript held in memory.
+
+        Returns:
+            An AnnotationResult with the same contents as the 
+            *_parse.txt, *_orig_dys.txt and *_dys.txt files 
+            written by parse_sentences().
+        """
+        return self.annotate_texts([text])[0]
+
+    def annotate_texts(self, texts):
+        """
+        Annotates several transcripts at once, returning one 
+        AnnotationResult per transcript (see annotate_text()).
+
+        The sentences of all the transcripts are parsed together, 
+        so short transcripts still fill up the sub-batches built 
+        by run_parser().
+        """
+        docs = [self.split_transcription(text) for text in texts]
+        parse_trees, df_labels, annotated_sentences = self.run_parser([sentence for doc in docs for sentence in doc])
+
+        results = []
+        start = 0
+        for doc in docs:
+            end = start + len(doc)
+            results.append(AnnotationResult(
+                parse="\n".join(parse_trees[start:end]),
+                orig_dys="\n".join(df_labels[start:end]),
+                dys=" ".join(annotated_sentences[start:end]),
+                ))
+            start = end
+
+        return results
+
     def parse_sentences(self):
         
         # input
-        input_filepath = self.input_path
-        input_filename = os.path.basename(input_filepath)
-        doc = self.read_transcription(input_filepath)
+        result = self.annotate_text(utils_general.read_file(self.input_path))
         
         # output
         output_dir = os.path.dirname(self.output_path)
         parse_filename = os.path.basename(self.output_path)
-        
-        # try:
-        parse_trees, df_labels = self.run_parser(doc) # so this doc needs to be a list of sentences
 
         # Write constituency parse trees and disfluency labels into files
         new_filename = os.path.join(output_dir, parse_filename.replace(".txt", "_parse.txt"))
         utils_general.delete_file_if_already_exists(new_filename)
         with open(new_filename, "w") as output_file:
-            output_file.write("\n".join(parse_trees))
+            output_file.write(result.parse)
 
         new_filename = os.path.join(output_dir, parse_filename.replace(".txt", "_orig_dys.txt"))
         utils_general.delete_file_if_already_exists(new_filename)
         with open(new_filename, "w") as output_file:
-            output_file.write("\n".join(df_labels))
+            output_file.write(result.orig_dys)
 
-        new_text = utils_trees.get_intj_prn_edited_transcript_from_tree_file(filepath=os.path.join(output_dir, parse_filename.replace(".txt", "_parse.txt")))
         new_filename = os.path.join(output_dir, parse_filename.replace(".txt", "_dys.txt"))
         utils_general.delete_file_if_already_exists(new_filename)
         with open(new_filename, "w") as output_file:
-            output_file.write(new_text)
-
-        # except Exception as e:
-        #     print("Exception:", e)
-        #     traceback.print_exc()
+            output_file.write(result.dys)
                     
         return
     
     # original function split into sentences based on short swb conversations
     # we adapt this function to have it split into sentences based on period (full stop) locations
     def read_transcription(self, trans_file):  
+        # reads the file line by line rather than all at once
         with open(trans_file) as f:
-            contents = f.read()
-            
-        # split into sentences
-        sentences = contents.replace("!",".").replace("?",".").split(".")  # split on sentences
-        
-        # limit sentences to 300 words for compatibility with the model architecture: https://github.com/nikitakit/self-attentive-parser/issues/37
-        limited_sentences = []
-        for sentence in sentences:
-            limited_sentences.append(" ".join(sentence.split(" ")[0:300]))
-        
-        # clean the sentences for compatibility with the model
-        cleaned_sentences = []
-        for sentence in limited_sentences:
-
-            # split into words within the sentences, clean
-            tokens = sentence.split(" ")
-            cleaned_tokens = []
-            for token in tokens:
-                token = self.validate_transcription(token)
-                if token is not None:
-                    cleaned_tokens.append(token)
-            cleaned_sentence = " ".join(cleaned_tokens)
-
-            if(len(cleaned_sentence) > 0):
-                cleaned_sentences.append(cleaned_sentence)
-                
-        # print("cs:", cleaned_sentences)
-                
-        return cleaned_sentences
+            return list(self.iter_transcription(f))
+
+    def split_transcription(self, contents):
+        return list(self.iter_transcription([contents]))
+
+    def iter_transcription(self, chunks):
+        """
+        Yields the cleaned sentences of a transcript given in pieces 
+        (e.g. the lines of a file), the same as split_transcription() 
+        on the whole transcript would return.
+        """
+        for sentence in iter_sentences(chunks):
+            # limit sentences to 300 words for compatibility with the model architecture: https://github.com/nikitakit/self-attentive-parser/issues/37
+            # (unless they are parsed in windows, see run_parser())
+            if self.long_sentences == "truncate":
+                tokens = sentence.split(" ", self.max_sentence_words)[:self.max_sentence_words]
+            else:
+                tokens = sentence.split(" ")
+
+            # clean the words for compatibility with the model
+            cleaned_sentence = " ".join(filter(None, map(normalize_token, tokens)))
+            if cleaned_sentence:
+                yield cleaned_sentence
 
     @staticmethod
     def validate_transcription(label):
-        if re.search(r"[0-9]|[(<\[\]&*{]", label):
-            return None
-
-        label = label.replace("_", " ")
-        label = re.sub("[ ]{2,}", " ", label)
-        label = label.replace(".", "")
-        label = label.replace(",", "")
-        label = label.replace(";", "")
-        label = label.replace("?", "")
-        label = label.replace("!", "")
-        label = label.replace(":", "")
-        label = label.replace("\"", "")
-        label = label.replace("'re", " 're")
-        label = label.replace("'ve", " 've")
-        label = label.replace("n't", " n't")
-        label = label.replace("'ll", " 'll")
-        label = label.replace("'d", " 'd")
-        label = label.replace("'m", " 'm")
-        label = label.replace("'s", " 's")
-        label = label.strip()
-        label = label.lower()
-
-        return label if label else None   
+        return normalize_token(label)
+
+
+MAX_SENTENCE_WORDS = 300
+
+# sentences end at full stops, question and exclamation marks
+SENTENCE_END_RE = re.compile(r"[.?!]")
+
+# words with digits or any of these characters are left out
+DROPPED_TOKEN_RE = re.compile(r"[0-9(<\[\]&*{]")
+# underscores are spaces, and runs of spaces (and underscores) become a single one
+SPACES_RE = re.compile(r"[ _]{2,}")
+TOKEN_TRANSLATION = str.maketrans({"_": " ", ".": None, ",": None, ";": None, "?": None, "!": None, ":": None, "\"": None})
+# contractions are split off as separate words, e.g. "don't" --> "do n't"; 
+# none of them can overlap another, so one pass finds them all
+CONTRACTION_RE = re.compile(r"'re|'ve|n't|'ll|'d|'m|'s")
+
+def iter_sentences(chunks):
+    # the transcript is split on SENTENCE_END_RE as a whole, 
+    # even where a sentence spans several chunks
+    pending = []
+    for chunk in chunks:
+        pieces = SENTENCE_END_RE.split(chunk)
+        if len(pieces) == 1:
+            pending.append(chunk)
+            continue
+        pending.append(pieces[0])
+        yield "".join(pending)
+        yield from pieces[1:-1]
+        pending = [pieces[-1]]
+    yield "".join(pending)
+
+# conversations reuse a small vocabulary, so most words are cleaned only once
+@functools.lru_cache(maxsize=2**16)
+def normalize_token(label):
+    """
+    Cleans a single word of a transcript, returning None if 
+    the word should be left out.
+    """
+    if DROPPED_TOKEN_RE.search(label):
+        return None
+
+    if "_" in label or "  " in label:
+        label = SPACES_RE.sub(" ", label)
+    label = label.translate(TOKEN_TRANSLATION)
+    if "'" in label:
+        label = CONTRACTION_RE.sub(r" \g<0>", label)
+    label = label.strip().lower()
+
+    return label if label else None
+
+def get_windows(num_words, window_size, overlap):
+    """
+    Splits a sentence of num_words words into windows of at most 
+    window_size words, each overlapping the next by overlap words.
+
+    Returns:
+        A (start, end, core_start, core_end) tuple per window, where 
+        words[start:end] is the window and words[core_start:core_end] 
+        the words whose labels come from it when the windows are 
+        stitched together: the overlaps are split in the middle.
+    """
+    assert 0 <= overlap < window_size, "The window overlap must be smaller than the window size"
+    step = window_size - overlap
+    starts = [0]
+    while starts[-1] + window_size < num_words:
+        starts.append(starts[-1] + step)
+    boundaries = [start + overlap // 2 for start in starts[1:]]
+    return [
+        (start, min(start + window_size, num_words), core_start, core_end) 
+        for start, core_start, core_end in zip(starts, [0] + boundaries, boundaries + [num_words])
+        ]
+
+def stitch_span_parses(sentence, windows, span_parses):
+    """
+    Joins the trees.SpanParse of each window (see get_windows()) into 
+    one for the whole sentence: each window contributes its labelled 
+    spans clipped to its core (so a constituent crossing the middle 
+    of an overlap keeps its labels on both sides), and the root gets 
+    the outermost label of the first window's root.
+    """
+    starts, ends, labels = [0], [len(sentence)], [span_parses[0].labels[0][:1]]
+    for (start, _, core_start, core_end), span_parse in zip(windows, span_parses):
+        for span_index, (span_start, span_end, label) in enumerate(zip(span_parse.starts, span_parse.ends, span_parse.labels)):
+            if span_index == 0:
+                # the window's root, whose outer label is only there because 
+                # the window was parsed as a sentence; it may hold more 
+                # labels covering the whole window, kept over its core
+                span_start, span_end, label = core_start - start, core_end - start, label[1:]
+            # clipping every span of a tree to the same interval keeps them 
+            # nested, so the stitched spans still form a tree
+            span_start = max(span_start + start, core_start)
+            span_end = min(span_end + start, core_end)
+            if label and span_start < span_end:
+                starts.append(span_start)
+                ends.append(span_end)
+                labels.append(label)
+    return trees.SpanParse(sentence, starts, ends, labels)
@@ -1,12 +1,19 @@
 """
-conda activate english-fisher-annotations; CUDA_VISIBLE_DEVICES=0 python get_english-fisher-annotations-LargeScale.py -p 0
-conda activate english-fisher-annotations; CUDA_VISIBLE_DEVICES=1 python get_english-fisher-annotations-LargeScale.py -p 1
+conda activate english-fisher-annotations; CUDA_VISIBLE_DEVICES=0 python get_english-fisher-annotations-LargeScale.py --num-shards 2 --shard-index 0
+conda activate english-fisher-annotations; CUDA_VISIBLE_DEVICES=1 python get_english-fisher-annotations-LargeScale.py --num-shards 2 --shard-index 1
+conda activate english-fisher-annotations; CUDA_VISIBLE_DEVICES="" python get_english-fisher-annotations-LargeScale.py --num-shards 8 --shard-index 0 --workers 8
+
+Episodes are assigned to shards by a stable hash of their episode_filename_prefix 
+(utils_general.get_shard_index), the same as in the WhisperX scripts.
+
+Results are appended to a journal (one JSON line per episode) as they are produced, 
+and episodes already in the journal are skipped, so a killed run can simply be restarted. 
+The output csv (or parquet) file is written from the journal once, at the end.
 """
 
 import os
 import json
 import pathlib
-import subprocess
 import logging
 from datetime import datetime
 import argparse
@@ -23,8 +30,7 @@ import utils_podcasts
 import time
 import math
 
-# start the timer
-start_time = time.time()
+import fisher_annotator
 
 # set var
 module_name = "english-fisher-annotations"
@@ -37,85 +43,106 @@ logging.basicConfig(filename=f"./logs/{module_name}-{datetime.now().isoformat(ti
 
 # set up argparse
 parser = argparse.ArgumentParser()
-parser.add_argument("-p", "--part", type=int, choices=[0,1], required=False, help="Select the split of the data to run.")
+utils_general.add_shard_arguments(parser)
+parser.add_argument("--pool-size", type=int, default=64, help="Number of transcripts whose sentences are parsed together.")
+parser.add_argument("--subbatch-max-tokens", type=int, default=3000, help="Maximum number of (subword) tokens parsed together in one batch.")
+parser.add_argument("--workers", type=int, default=1, help="Number of worker processes parsing sentences on the CPU.")
+parser.add_argument("--threads-per-worker", type=int, help="torch threads per worker process (default: number of cores / workers).")
+parser.add_argument("--quantize", type=str, choices=["dynamic"], help="Run the model with int8 dynamic quantization (CPU only).")
+parser.add_argument("--decoder", type=str, choices=["auto", "cython", "numba", "numpy"], default="auto", help="CKY decoder implementation (they all give the same results).")
+parser.add_argument("--long-sentences", type=str, choices=["truncate", "window"], default="truncate", help="Truncate sentences longer than --max-sentence-words words, or parse them in overlapping windows.")
+parser.add_argument("--max-sentence-words", type=int, default=300, help="Maximum number of words parsed as one sentence (the window size).")
+parser.add_argument("--window-overlap", type=int, default=50, help="Number of words shared by consecutive windows of a long sentence.")
+parser.add_argument("--output-format", type=str, choices=["csv", "parquet"], default="csv", help="Format of the final output file.")
 args = parser.parse_args()
-
-# set up csv path
-csv_path = f"../csv/df-{module_name}-{split_name}-{asr_name}-{args.part}.csv"
-
-# function for running the annotator
-def get_subprocess_cmd(input_path, output_path):
-    cmd = f"""python main.py 
-              --input-path {input_path}
-              --output-path {output_path}
-              --model ./model/swbd_fisher_bert_Edev.0.9078.pt"""
-    cmd = cmd.split()
-    return cmd
-
-
-df = pd.read_csv(f"../csv/large_scale_texts-{args.part}.csv", index_col=0)
-
-pbar = tqdm(total=len(df))
-
-# initialize df output
-df[f"{asr_name}_parse"] = ""
-df[f"{asr_name}_orig_dys"] = ""
-df[f"{asr_name}_dys"] = ""
-
-# set up temp dir
-utils_general.just_create_this_dir("./temp")
-
-# iterate through df and run the parser on each file/transcript
-for index, row in df.iterrows():
+utils_general.check_shard_arguments(parser, args)
+
+# set up output and journal paths
+output_path = f"../csv/df-{module_name}-{split_name}-{asr_name}-{args.shard_index}-of-{args.num_shards}.{args.output_format}"
+journal_path = f"../csv/journal-{module_name}-{split_name}-{asr_name}-{args.shard_index}-of-{args.num_shards}.jsonl"
+
+# set up the annotator, which loads the model once and keeps it in memory for every transcript
+annotator = fisher_annotator.Annotate(
+    model="./model/swbd_fisher_bert_Edev.0.9078.pt", 
+    disfluency=True, 
+    subbatch_max_tokens=args.subbatch_max_tokens, 
+    workers=args.workers, 
+    threads_per_worker=args.threads_per_worker, 
+    quantize=args.quantize, 
+    decoder=args.decoder, 
+    long_sentences=args.long_sentences, 
+    max_sentence_words=args.max_sentence_words, 
+    window_overlap=args.window_overlap,
+    )
+
+
+df = pd.read_csv(f"../csv/large_scale_texts.csv", index_col=0)
+
+# only keep the episodes in this shard
+df = df[df["episode_filename_prefix"].map(lambda e: utils_general.is_in_shard(str(e), args.num_shards, args.shard_index))]
+
+# skip the episodes that a previous run already annotated; the ones whose latest record 
+# is a failure (e.g. a transient CUDA out of memory error) are tried again
+latest_records = {record["episode_filename_prefix"]: record for record in utils_general.read_jsonl_records(journal_path)}
+done_episodes = {episode for episode, record in latest_records.items() if "error" not in record}
+todo_df = df[~df["episode_filename_prefix"].isin(done_episodes)]
+
+pbar = tqdm(total=len(df), initial=len(df) - len(todo_df))
+
+# function for running the annotator on a pool of transcripts, returning one journal record per episode, 
+# which has an "error" instead of the annotations if the transcript could not be annotated
+def annotate_pool(episodes, texts):
+    try:
+        results = annotator.annotate_texts(texts)
     
-    # some podcasts have no transcript
-    if row[asr_name] != "":
+    except Exception as e:
         
-        input_filepath = f"/home/grads/m/mariateleki/analysis-spotify/english-fisher-annotations/temp/temp-result-df-{args.part}.txt"
-        utils_general.write_file(new_filename=os.path.basename(input_filepath), 
-                                 directory=os.path.dirname(input_filepath), 
-                                 text=str(row[asr_name]))
+        # retry the transcripts one by one, so that only the failing one(s) are marked
+        if len(texts) > 1:
+            records = []
+            for episode, text in zip(episodes, texts):
+                records.extend(annotate_pool([episode], [text]))
+            return records
         
-        output_filepath = f"/home/grads/m/mariateleki/analysis-spotify/english-fisher-annotations/temp/temp-result-df-{args.part}.txt"
+        logging.debug(f"{episodes[0]}: {e}")
+        traceback.print_exc()
         
-        try: 
-            # run the parser
-            result = subprocess.call(get_subprocess_cmd(input_path=input_filepath, output_path=output_filepath))
-            
-            # then write the results into the df
-            df.loc[index, f"{asr_name}_parse"] = utils_general.read_file(output_filepath.replace(".txt", "_parse.txt"))
-            df.loc[index, f"{asr_name}_orig_dys"] = utils_general.read_file(output_filepath.replace(".txt", "_orig_dys.txt"))
-            df.loc[index, f"{asr_name}_dys"] = utils_general.read_file(output_filepath.replace(".txt", "_dys.txt"))
-            
-        except Exception as e:
-            
-            df.loc[index, f"{asr_name}_parse"] = module_name
-            df.loc[index, f"{asr_name}_orig_dys"] = module_name
-            df.loc[index, f"{asr_name}_dys"] = module_name
-            
-            logging.debug(input_filepath, ":", e)
-            traceback.print_exc()
-            
-            
-    # update the progress bar 
-    pbar.update(1)
+        return [{"episode_filename_prefix": episodes[0], "error": repr(e)}]
     
-    # check if it's time to exit
-    elapsed_time = time.time() - start_time
+    return [dict(result._asdict(), episode_filename_prefix=episode) for episode, result in zip(episodes, results)]
 
-    # Exit the script if 10 minutes have passed
-    if elapsed_time >= 600:  # 10 minutes = 600 seconds
-        
-        # write out the results
-        print("Writing out results so far to df.")
-        df.to_csv(csv_path, header=True)
+# iterate through df in pools of transcripts, and run the parser on all the sentences of a pool at once
+for pool_start in range(0, len(todo_df), args.pool_size):
+    pool_df = todo_df.iloc[pool_start:pool_start+args.pool_size]
+    
+    # some podcasts have no transcript (read_csv loads a missing one as NaN)
+    pool_df = pool_df[pool_df[asr_name].notna() & (pool_df[asr_name].astype(str).str.strip() != "")]
+    
+    if len(pool_df) > 0:
+        records = annotate_pool([str(episode) for episode in pool_df["episode_filename_prefix"]], 
+                                [str(text) for text in pool_df[asr_name]])
         
-        # reset the clock
-        start_time = time.time()
+        # checkpoint the results of this pool
+        utils_general.append_jsonl_records(journal_path, records)
+            
+    # update the progress bar 
+    pbar.update(min(args.pool_size, len(todo_df) - pool_start))
         
-# write out results
+# write the results in the journal into the df
 print("Writing out final results.")
-df.to_csv(csv_path, header=True)
+results_df = pd.DataFrame(utils_general.read_jsonl_records(journal_path), columns=["episode_filename_prefix", "parse", "orig_dys", "dys", "error"])
+results_df = results_df.drop_duplicates("episode_filename_prefix", keep="last").set_index("episode_filename_prefix")
+# the transcripts that still failed are marked with the module name
+results_df.loc[results_df["error"].notna(), ["parse", "orig_dys", "dys"]] = module_name
+for column in ["parse", "orig_dys", "dys"]:
+    df[f"{asr_name}_{column}"] = df["episode_filename_prefix"].astype(str).map(results_df[column]).fillna("")
+
+# write out results
+if args.output_format == "parquet":
+    df.to_parquet(output_path)
+else:
+    df.to_csv(output_path, header=True)
 
-# close the progress bar
+# close the progress bar and the worker processes
 pbar.close()
+annotator.close_worker_pool()
@@ -5,7 +5,6 @@ conda activate english-fisher-annotations; CUDA_VISIBLE_DEVICES=0 python get_eng
 import os
 import json
 import pathlib
-import subprocess
 import logging
 from datetime import datetime
 import argparse
@@ -22,6 +21,8 @@ import utils_podcasts
 import time
 import math
 
+import fisher_annotator
+
 # start the timer
 start_time = time.time()
 
@@ -37,14 +38,8 @@ csv_path = f"../csv/df-{module_name}-{split_name}-{asr_name}.csv"
 utils_general.just_create_this_dir("./logs")
 logging.basicConfig(filename=f"./logs/{module_name}-{datetime.now().isoformat(timespec='seconds')}.log", level=logging.DEBUG)
 
-# function for running the annotator
-def get_subprocess_cmd(input_path, output_path):
-    cmd = f"""python main.py 
-              --input-path {input_path}
-              --output-path {output_path}
-              --model ./model/swbd_fisher_bert_Edev.0.9078.pt"""
-    cmd = cmd.split()
-    return cmd
+# set up the annotator, which loads the model once and keeps it in memory for every transcript
+annotator = fisher_annotator.Annotate(model="./model/swbd_fisher_bert_Edev.0.9078.pt", disfluency=True)
 
 df = pd.read_csv(f"../csv/small_scale_texts.csv", index_col=0)
 
@@ -55,30 +50,20 @@ df[f"{asr_name}_parse"] = ""
 df[f"{asr_name}_orig_dys"] = ""
 df[f"{asr_name}_dys"] = ""
 
-# set up temp dir
-utils_general.just_create_this_dir("./temp")
-
 # iterate through df and run the parser on each file/transcript
 for index, row in df.iterrows():
     
     # some podcasts have no transcript
     if row[asr_name] != "":
         
-        input_filepath = f"/home/grads/m/mariateleki/analysis-spotify/english-fisher-annotations/temp/temp-result-df.txt"
-        utils_general.write_file(new_filename=os.path.basename(input_filepath), 
-                                 directory=os.path.dirname(input_filepath), 
-                                 text=str(row[asr_name]))
-        
-        output_filepath = f"/home/grads/m/mariateleki/analysis-spotify/english-fisher-annotations/temp/temp-result-df.txt"
-        
         try: 
             # run the parser
-            result = subprocess.call(get_subprocess_cmd(input_path=input_filepath, output_path=output_filepath))
+            result = annotator.annotate_text(str(row[asr_name]))
             
             # then write the results into the df
-            df.loc[index, f"{asr_name}_parse"] = utils_general.read_file(output_filepath.replace(".txt", "_parse.txt"))
-            df.loc[index, f"{asr_name}_orig_dys"] = utils_general.read_file(output_filepath.replace(".txt", "_orig_dys.txt"))
-            df.loc[index, f"{asr_name}_dys"] = utils_general.read_file(output_filepath.replace(".txt", "_dys.txt"))
+            df.loc[index, f"{asr_name}_parse"] = result.parse
+            df.loc[index, f"{asr_name}_orig_dys"] = result.orig_dys
+            df.loc[index, f"{asr_name}_dys"] = result.dys
             
         except Exception as e:
             
@@ -86,7 +71,7 @@ for index, row in df.iterrows():
             df.loc[index, f"{asr_name}_orig_dys"] = module_name
             df.loc[index, f"{asr_name}_dys"] = module_name
             
-            logging.debug(input_filepath, ":", e)
+            logging.debug(f"{index}: {e}")
             traceback.print_exc()
             
             
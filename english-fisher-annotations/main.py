@@ -1,29 +1,97 @@
 #!/usr/bin/env python3
 
 import argparse
+import io
+import json
 import os
+import socketserver
+import sys
 
 import fisher_annotator
 
 
+def serve_stream(labels, input_stream, output_stream):
+    """
+    Reads one JSON request per line from input_stream, e.g.
+        {"id": "episode-1", "text": "she she likes movies."}
+    and writes one JSON response per line to output_stream, e.g.
+        {"id": "episode-1", "parse": "...", "orig_dys": "...", "dys": "..."}
+    Failed requests get an "error" field instead of the annotations.
+    """
+    for line in input_stream:
+        if not line.strip():
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            response = {"id": request_id}
+            response.update(labels.annotate_text(request["text"])._asdict())
+        except Exception as e:
+            response = {"id": request_id, "error": repr(e)}
+        output_stream.write(json.dumps(response) + "\n")
+        output_stream.flush()
+
+
+def serve_socket(labels, port):
+    class AnnotationHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            serve_stream(
+                labels,
+                io.TextIOWrapper(self.rfile, encoding="utf-8"),
+                io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True),
+                )
+
+    # requests are handled one connection at a time, since they all share one model
+    with socketserver.TCPServer(("127.0.0.1", port), AnnotationHandler) as server:
+        print("Serving annotations on 127.0.0.1:{}".format(port), file=sys.stderr)
+        server.serve_forever()
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input-path", type=str, required=True)
-    parser.add_argument("--output-path", type=str, required=True)
+    parser.add_argument("--input-path", type=str)
+    parser.add_argument("--output-path", type=str)
     parser.add_argument("--model", type=str, default="./model/swbd_fisher_bert_Edev.0.9078.pt")
     parser.add_argument("--disfluency", type=bool, default=True)
+    parser.add_argument("--subbatch-max-tokens", type=int, default=3000, help="Maximum number of (subword) tokens parsed together in one batch.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes parsing sub-batches (CPU only).")
+    parser.add_argument("--threads-per-worker", type=int, help="torch threads per worker process (default: number of cores / workers).")
+    parser.add_argument("--quantize", type=str, choices=["dynamic"], help="Run the model with int8 dynamic quantization of its linear layers (CPU only).")
+    parser.add_argument("--decoder", type=str, choices=["auto", "cython", "numba", "numpy"], default="auto", help="CKY decoder implementation (they all give the same results).")
+    parser.add_argument("--long-sentences", type=str, choices=["truncate", "window"], default="truncate", help="Truncate sentences longer than --max-sentence-words words, or parse them in overlapping windows.")
+    parser.add_argument("--max-sentence-words", type=int, default=300, help="Maximum number of words parsed as one sentence (the window size).")
+    parser.add_argument("--window-overlap", type=int, default=50, help="Number of words shared by consecutive windows of a long sentence.")
+    parser.add_argument("--serve", action="store_true", help="Annotate JSON lines from stdin, writing JSON lines to stdout.")
+    parser.add_argument("--port", type=int, help="Annotate JSON lines sent to this port on 127.0.0.1.")
     args = parser.parse_args()
-    
+
     # print(args)
 
+    if not (args.serve or args.port) and not (args.input_path and args.output_path):
+        parser.error("--input-path and --output-path are required unless --serve or --port is given")
+
     labels = fisher_annotator.Annotate(
         input_path=args.input_path,
         output_path=args.output_path,
         model=args.model,
         disfluency=args.disfluency,
+        subbatch_max_tokens=args.subbatch_max_tokens,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        quantize=args.quantize,
+        decoder=args.decoder,
+        long_sentences=args.long_sentences,
+        max_sentence_words=args.max_sentence_words,
+        window_overlap=args.window_overlap,
         )
-    
-    labels.setup()
+
+    if args.port:
+        serve_socket(labels, args.port)
+    elif args.serve:
+        serve_stream(labels, sys.stdin, sys.stdout)
+    else:
+        labels.setup()
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,12 @@
+import concurrent.futures
 import functools
+import inspect
+import itertools
+import os
+import sys
 
 import numpy as np
+import pandas as pd
 
 import torch
 import torch.nn as nn
@@ -12,13 +18,9 @@ if use_cuda:
     def from_numpy(ndarray):
         return torch.from_numpy(ndarray).pin_memory().cuda(non_blocking=True)
 else:
-    print("Not using CUDA!")
     torch_t = torch
     from torch import from_numpy
 
-import pyximport
-pyximport.install(setup_args={"include_dirs": np.get_include()})
-import chart_helper
 import nkutil
 
 import trees
@@ -59,6 +61,105 @@ BERT_TOKEN_MAPPING = {
     "\u2014": "--", # em dash
     }
 
+# Number of distinct words whose BERT wordpiece ids are cached by each parser
+BERT_WORD_CACHE_SIZE = 2 ** 16
+
+# Maximum number of spans scored together in one f_label call at inference time
+LABEL_CHART_MAX_CELLS = 2 ** 16
+
+def num_packed_spans(num_fenceposts):
+    return num_fenceposts * (num_fenceposts - 1) // 2
+
+@functools.lru_cache(maxsize=None)
+def packed_span_fenceposts(num_fenceposts):
+    # Start and end fenceposts of the spans i < j, in row-major order
+    return np.triu_indices(num_fenceposts, 1)
+
+def make_index_lookup(index_map):
+    # A pandas Index over the keys of index_map (from Vocabulary.index_map()),
+    # with their indices, for lookup_indices()
+    return pd.Index(list(index_map), dtype=object), np.fromiter(index_map.values(), dtype=int, count=len(index_map))
+
+def lookup_indices(index_lookup, values, unk_index):
+    # Indices of all the values at once (one hash table lookup in pandas, not
+    # a Python dict lookup per value), with unk_index for the missing values
+    keys, indices = index_lookup
+    positions = keys.get_indexer(np.array(values, dtype=object))
+    return np.where(positions >= 0, indices[positions], unk_index)
+
+# The chart decoder, loaded on first use by get_chart_helper(), and which
+# implementation it is (one of CHART_DECODERS, see set_chart_decoder())
+chart_helper = None
+chart_decoder_name = "auto"
+
+CHART_DECODERS = ("auto", "cython", "numba", "numpy")
+
+def set_chart_decoder(name):
+    # "cython" is chart_helper.pyx, "numba" and "numpy" are the decoders of
+    # chart_decoder.py (which all give the same results), and "auto" is the
+    # first of those that is available
+    global chart_helper, chart_decoder_name
+    assert name in CHART_DECODERS, "Unknown chart decoder: {}".format(name)
+    if name != chart_decoder_name:
+        chart_decoder_name = name
+        chart_helper = None
+
+def get_chart_helper():
+    global chart_helper
+    if chart_helper is None:
+        chart_helper = load_chart_decoder(chart_decoder_name)
+    return chart_helper
+
+def load_chart_decoder(name):
+    if name in ("auto", "cython"):
+        # a prebuilt chart_helper extension, or else compile chart_helper.pyx
+        try:
+            import chart_helper as decoder
+            return decoder
+        except ImportError:
+            try:
+                import pyximport
+                pyximport.install(setup_args={"include_dirs": np.get_include()})
+                import chart_helper as decoder
+                return decoder
+            except ImportError as e:
+                if name == "cython":
+                    raise
+                print("Could not compile chart_helper.pyx ({}), using chart_decoder.py instead".format(e), file=sys.stderr)
+
+    import chart_decoder
+    if name == "numba" and chart_decoder.numba_decoder is None:
+        raise ImportError("The numba chart decoder needs numba to be installed")
+    if name in ("auto", "numba") and chart_decoder.numba_decoder is not None:
+        return chart_decoder.numba_decoder
+    return chart_decoder.numpy_decoder
+
+# Whether modules can be built without initializing their weights, and then
+# take over the tensors of a state dict (load_state_dict(assign=True), torch >= 2.1)
+SKIP_WEIGHT_INIT_SUPPORTED = hasattr(torch.overrides, "TorchFunctionMode") and "assign" in inspect.signature(nn.Module.load_state_dict).parameters
+
+if SKIP_WEIGHT_INIT_SUPPORTED:
+    class SkipWeightInit(torch.overrides.TorchFunctionMode):
+        # Turns the in-place initializations of weights into no-ops, which
+        # leaves them uninitialized. (Building the modules on the meta
+        # device would do too, but on recent torch versions it imports
+        # torch._dynamo, which takes longer than initializing the weights.)
+        def __torch_function__(self, func, types, args=(), kwargs=None):
+            kwargs = kwargs or {}
+            if getattr(func, "__name__", None) in ("normal_", "uniform_", "zero_", "fill_"):
+                return args[0] if args else kwargs["tensor"]
+            return func(*args, **kwargs)
+
+# Thread pools for decoding charts in parallel, by (process id, pool size).
+# A thread pool does not survive a fork, so each process makes its own.
+DECODE_EXECUTORS = {}
+
+def get_decode_executor(max_workers):
+    key = (os.getpid(), max_workers)
+    if key not in DECODE_EXECUTORS:
+        DECODE_EXECUTORS[key] = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    return DECODE_EXECUTORS[key]
+
 # %%
 
 class BatchIndices:
@@ -296,7 +397,9 @@ class MultiHeadAttention(nn.Module):
         q_padded = q_s.new_zeros((n_head, mb_size, len_padded, d_k))
         k_padded = k_s.new_zeros((n_head, mb_size, len_padded, d_k))
         v_padded = v_s.new_zeros((n_head, mb_size, len_padded, d_v))
-        invalid_mask = q_s.new_ones((mb_size, len_padded), dtype=torch.uint8)
+        # bool rather than uint8, since ~ on a uint8 tensor is a bitwise not in
+        # current pytorch versions, which breaks output_mask for padded batches
+        invalid_mask = q_s.new_ones((mb_size, len_padded), dtype=torch.bool)
 
         for i, (start, end) in enumerate(zip(batch_idxs.boundaries_np[:-1], batch_idxs.boundaries_np[1:])):
             q_padded[:,i,:end-start,:] = q_s[:,start:end,:]
@@ -589,6 +692,11 @@ def get_bert(bert_model, bert_do_lower_case):
     bert = BertModel.from_pretrained(bert_model)
     return tokenizer, bert
 
+def get_bert_from_config(bert_config):
+    # Only the architecture, for when the weights come from a state dict
+    from pytorch_pretrained_bert import BertConfig, BertModel
+    return BertModel(BertConfig.from_dict(bert_config))
+
 # %%
 
 class Encoder(nn.Module):
@@ -647,17 +755,23 @@ class NKChartParser(nn.Module):
             label_vocab,
             char_vocab,
             hparams,
+            bert_tokenizer=None,
+            bert_config=None,
     ):
         super().__init__()
         self.spec = locals()
         self.spec.pop("self")
         self.spec.pop("__class__")
+        self.spec.pop("bert_tokenizer")
+        self.spec.pop("bert_config")
         self.spec['hparams'] = hparams.to_dict()
 
         self.tag_vocab = tag_vocab
         self.word_vocab = word_vocab
         self.label_vocab = label_vocab
         self.char_vocab = char_vocab
+        # word/tag -> index dicts for inference, built on first use
+        self.inference_index_maps = None
 
         self.d_model = hparams.d_model
         self.partitioned = hparams.partitioned
@@ -723,13 +837,24 @@ class NKChartParser(nn.Module):
             # the projection trainable appears to improve parsing accuracy
             self.project_elmo = nn.Linear(d_elmo_annotations, self.d_content, bias=False)
         elif hparams.use_bert or hparams.use_bert_only:
-            self.bert_tokenizer, self.bert = get_bert(hparams.bert_model, hparams.bert_do_lower_case)
+            if bert_config is not None:
+                # from an exported model, see to_artifact()
+                self.bert_tokenizer, self.bert = bert_tokenizer, get_bert_from_config(bert_config)
+            else:
+                self.bert_tokenizer, self.bert = get_bert(hparams.bert_model, hparams.bert_do_lower_case)
             if hparams.bert_transliterate:
                 from transliterate import TRANSLITERATIONS
                 self.bert_transliterate = TRANSLITERATIONS[hparams.bert_transliterate]
             else:
                 self.bert_transliterate = None
 
+            # Transcripts reuse a small vocabulary over and over, so the
+            # wordpiece ids of each word are cached (and shared between
+            # split_batch and parse_batch), in a plain dict so that the
+            # parser stays picklable
+            self.bert_word_ids_cache = {}
+            self.bert_cls_id, self.bert_sep_id = self.bert_tokenizer.convert_tokens_to_ids(["[CLS]", "[SEP]"])
+
             d_bert_annotations = self.bert.pooler.dense.in_features
             self.bert_max_len = self.bert.embeddings.position_embeddings.num_embeddings
 
@@ -793,7 +918,7 @@ class NKChartParser(nn.Module):
         return self.state_dict()
 
     @classmethod
-    def from_spec(cls, spec, model):
+    def from_spec(cls, spec, model, bert_tokenizer=None, bert_config=None):
         spec = spec.copy()
         hparams = spec['hparams']
         if 'use_chars_concat' in hparams and hparams['use_chars_concat']:
@@ -814,7 +939,20 @@ class NKChartParser(nn.Module):
             hparams['bert_transliterate'] = ""
 
         spec['hparams'] = nkutil.HParams(**hparams)
-        res = cls(**spec)
+        if bert_config is not None and not hparams['use_elmo'] and SKIP_WEIGHT_INIT_SUPPORTED:
+            # Every weight of an exported model is in its state dict, so the
+            # modules are built without initializing their weights, and then
+            # take over the (possibly memory-mapped) tensors of the state dict
+            # as they are
+            with SkipWeightInit():
+                res = cls(**spec, bert_tokenizer=bert_tokenizer, bert_config=bert_config)
+            assert all(name in model for name, _ in itertools.chain(res.named_parameters(), res.named_buffers())), "Weights missing from the state dict"
+            res.load_state_dict(model, assign=True)
+            if use_cuda:
+                res.cuda()
+            return res
+
+        res = cls(**spec, bert_tokenizer=bert_tokenizer, bert_config=bert_config)
         if use_cuda:
             res.cpu()
         if not hparams['use_elmo']:
@@ -827,10 +965,55 @@ class NKChartParser(nn.Module):
             res.cuda()
         return res
 
+    def to_artifact(self):
+        # Everything from_spec needs to rebuild this parser, including the
+        # BERT tokenizer and config, so that loading it does not need the
+        # original BERT files
+        artifact = {
+            'spec': self.spec,
+            'state_dict': self.state_dict(),
+        }
+        if self.bert is not None:
+            artifact['bert_tokenizer'] = self.bert_tokenizer
+            artifact['bert_config'] = self.bert.config.to_dict()
+        return artifact
+
+    def bert_word_ids(self, word):
+        word_ids = self.bert_word_ids_cache.get(word)
+        if word_ids is None:
+            if len(self.bert_word_ids_cache) >= BERT_WORD_CACHE_SIZE:
+                self.bert_word_ids_cache.clear()
+            word_ids = tuple(self.bert_tokenizer.convert_tokens_to_ids(self.bert_tokenizer.tokenize(word)))
+            self.bert_word_ids_cache[word] = word_ids
+        return word_ids
+
+    def bert_cleaned_words(self, sentence):
+        if self.bert_transliterate is None:
+            cleaned_words = []
+            for _, word in sentence:
+                word = BERT_TOKEN_MAPPING.get(word, word)
+                # This un-escaping for / and * was not yet added for the
+                # parser version in https://arxiv.org/abs/1812.11760v1
+                # and related model releases (e.g. benepar_en2)
+                word = word.replace('\\/', '/').replace('\\*', '*')
+                # Mid-token punctuation occurs in biomedical text
+                word = word.replace('-LSB-', '[').replace('-RSB-', ']')
+                word = word.replace('-LRB-', '(').replace('-RRB-', ')')
+                if word == "n't" and cleaned_words:
+                    cleaned_words[-1] = cleaned_words[-1] + "n"
+                    word = "'t"
+                cleaned_words.append(word)
+        else:
+            # When transliterating, assume that the token mapping is
+            # taken care of elsewhere
+            cleaned_words = [self.bert_transliterate(word) for _, word in sentence]
+        return cleaned_words
+
     def split_batch(self, sentences, golds, subbatch_max_tokens=3000):
         if self.bert is not None:
+            # Same wordpieces as parse_batch will feed to BERT, plus [CLS] and [SEP]
             lens = [
-                len(self.bert_tokenizer.tokenize(' '.join([word for (_, word) in sentence]))) + 2
+                sum([len(self.bert_word_ids(word)) for word in self.bert_cleaned_words(sentence)]) + 2
                 for sentence in sentences
             ]
         else:
@@ -850,11 +1033,39 @@ class NKChartParser(nn.Module):
             else:
                 subbatch_size += 1
 
+    def packed_inference_idxs(self, sentences, packed_len):
+        if self.inference_index_maps is None:
+            self.inference_index_maps = (
+                make_index_lookup(self.tag_vocab.index_map()),
+                make_index_lookup(self.word_vocab.index_map(min_count=1, keep=(START, STOP))),
+                )
+        tag_index_lookup, word_index_lookup = self.inference_index_maps
+
+        lens = np.fromiter((len(sentence) + 2 for sentence in sentences), dtype=int, count=len(sentences))
+        batch_idxs = np.repeat(np.arange(len(sentences)), lens)
+
+        # the tags and words of the whole batch, with START and STOP around each sentence,
+        # looked up in one go
+        tags, words = [], []
+        for sentence in sentences:
+            sentence_tags, sentence_words = zip(*sentence) if sentence else ((), ())
+            tags += (START,) + sentence_tags + (STOP,)
+            words += (START,) + sentence_words + (STOP,)
+        assert len(words) == packed_len
+
+        if not self.use_tags and self.f_tag is None:
+            tag_idxs = np.zeros(packed_len, dtype=int)
+        else:
+            tag_idxs = lookup_indices(tag_index_lookup, tags, self.tag_vocab.indices.get(TAG_UNK))
+        word_idxs = lookup_indices(word_index_lookup, words, self.word_vocab.indices.get(UNK))
+
+        return tag_idxs, word_idxs, batch_idxs
+
     def parse(self, sentence, gold=None):
         tree_list, loss_list = self.parse_batch([sentence], [gold] if gold is not None else None)
         return tree_list[0], loss_list[0]
 
-    def parse_batch(self, sentences, golds=None, return_label_scores_charts=False):
+    def parse_batch(self, sentences, golds=None, return_label_scores_charts=False, make_trees=True):
         is_train = golds is not None
         self.train(is_train)
         torch.set_grad_enabled(is_train)
@@ -864,21 +1075,24 @@ class NKChartParser(nn.Module):
 
         packed_len = sum([(len(sentence) + 2) for sentence in sentences])
 
-        i = 0
-        tag_idxs = np.zeros(packed_len, dtype=int)
-        word_idxs = np.zeros(packed_len, dtype=int)
-        batch_idxs = np.zeros(packed_len, dtype=int)
-        for snum, sentence in enumerate(sentences):
-            for (tag, word) in [(START, START)] + sentence + [(STOP, STOP)]:
-                tag_idxs[i] = 0 if (not self.use_tags and self.f_tag is None) else self.tag_vocab.index_or_unk(tag, TAG_UNK)
-                if word not in (START, STOP):
-                    count = self.word_vocab.count(word)
-                    if not count or (is_train and np.random.rand() < 1 / (1 + count)):
-                        word = UNK
-                word_idxs[i] = self.word_vocab.index(word)
-                batch_idxs[i] = snum
-                i += 1
-        assert i == packed_len
+        if is_train:
+            i = 0
+            tag_idxs = np.zeros(packed_len, dtype=int)
+            word_idxs = np.zeros(packed_len, dtype=int)
+            batch_idxs = np.zeros(packed_len, dtype=int)
+            for snum, sentence in enumerate(sentences):
+                for (tag, word) in [(START, START)] + sentence + [(STOP, STOP)]:
+                    tag_idxs[i] = 0 if (not self.use_tags and self.f_tag is None) else self.tag_vocab.index_or_unk(tag, TAG_UNK)
+                    if word not in (START, STOP):
+                        count = self.word_vocab.count(word)
+                        if not count or (is_train and np.random.rand() < 1 / (1 + count)):
+                            word = UNK
+                    word_idxs[i] = self.word_vocab.index(word)
+                    batch_idxs[i] = snum
+                    i += 1
+            assert i == packed_len
+        else:
+            tag_idxs, word_idxs, batch_idxs = self.packed_inference_idxs(sentences, packed_len)
 
         batch_idxs = BatchIndices(batch_idxs)
         
@@ -971,58 +1185,30 @@ class NKChartParser(nn.Module):
 
             subword_max_len = 0
             for snum, sentence in enumerate(sentences):
-                tokens = []
-                word_start_mask = []
-                word_end_mask = []
-
-                tokens.append("[CLS]")
-                word_start_mask.append(1)
-                word_end_mask.append(1)
-
-                if self.bert_transliterate is None:
-                    cleaned_words = []
-                    for _, word in sentence:
-                        word = BERT_TOKEN_MAPPING.get(word, word)
-                        # This un-escaping for / and * was not yet added for the
-                        # parser version in https://arxiv.org/abs/1812.11760v1
-                        # and related model releases (e.g. benepar_en2)
-                        word = word.replace('\\/', '/').replace('\\*', '*')
-                        # Mid-token punctuation occurs in biomedical text
-                        word = word.replace('-LSB-', '[').replace('-RSB-', ']')
-                        word = word.replace('-LRB-', '(').replace('-RRB-', ')')
-                        if word == "n't" and cleaned_words:
-                            cleaned_words[-1] = cleaned_words[-1] + "n"
-                            word = "'t"
-                        cleaned_words.append(word)
-                else:
-                    # When transliterating, assume that the token mapping is
-                    # taken care of elsewhere
-                    cleaned_words = [self.bert_transliterate(word) for _, word in sentence]
-
-                for word in cleaned_words:
-                    word_tokens = self.bert_tokenizer.tokenize(word)
-                    for _ in range(len(word_tokens)):
-                        word_start_mask.append(0)
-                        word_end_mask.append(0)
-                    word_start_mask[len(tokens)] = 1
-                    word_end_mask[-1] = 1
-                    tokens.extend(word_tokens)
-                tokens.append("[SEP]")
-                word_start_mask.append(1)
-                word_end_mask.append(1)
-
-                input_ids = self.bert_tokenizer.convert_tokens_to_ids(tokens)
+                word_ids = [self.bert_word_ids(word) for word in self.bert_cleaned_words(sentence)]
+                word_lens = np.fromiter(map(len, word_ids), dtype=int, count=len(word_ids))
+                if not word_lens.all():
+                    raise ValueError("Word without any BERT wordpieces in: {}".format(sentence))
+                # positions of the first and last wordpiece of each word, after [CLS]
+                word_ends = np.cumsum(word_lens)
+                word_starts = word_ends - word_lens + 1
+                num_subwords = int(word_lens.sum()) + 2
+
+                all_input_ids[snum, 0] = self.bert_cls_id
+                all_input_ids[snum, 1:num_subwords - 1] = np.fromiter(
+                    itertools.chain.from_iterable(word_ids), dtype=int, count=num_subwords - 2)
+                all_input_ids[snum, num_subwords - 1] = self.bert_sep_id
 
                 # The mask has 1 for real tokens and 0 for padding tokens. Only real
                 # tokens are attended to.
-                input_mask = [1] * len(input_ids)
+                all_input_mask[snum, :num_subwords] = 1
 
-                subword_max_len = max(subword_max_len, len(input_ids))
+                all_word_start_mask[snum, [0, num_subwords - 1]] = 1
+                all_word_start_mask[snum, word_starts] = 1
+                all_word_end_mask[snum, [0, num_subwords - 1]] = 1
+                all_word_end_mask[snum, word_ends] = 1
 
-                all_input_ids[snum, :len(input_ids)] = input_ids
-                all_input_mask[snum, :len(input_mask)] = input_mask
-                all_word_start_mask[snum, :len(word_start_mask)] = word_start_mask
-                all_word_end_mask[snum, :len(word_end_mask)] = word_end_mask
+                subword_max_len = max(subword_max_len, num_subwords)
 
             all_input_ids = from_numpy(np.ascontiguousarray(all_input_ids[:, :subword_max_len]))
             all_input_mask = from_numpy(np.ascontiguousarray(all_input_mask[:, :subword_max_len]))
@@ -1080,29 +1266,18 @@ class NKChartParser(nn.Module):
 
         # Just return the charts, for ensembling
         if return_label_scores_charts:
-            charts = []
-            for i, (start, end) in enumerate(zip(fp_startpoints, fp_endpoints)):
-                chart = self.label_scores_from_annotations(fencepost_annotations_start[start:end,:], fencepost_annotations_end[start:end,:])
-                charts.append(chart.cpu().data.numpy())
-            return charts
+            return self.label_scores_charts_from_annotations(fencepost_annotations_start, fencepost_annotations_end, fp_startpoints, fp_endpoints)
 
         if not is_train:
-            trees = []
-            scores = []
             if self.f_tag is not None:
                 # Note that tag_logits includes tag predictions for start/stop tokens
                 tag_idxs = torch.argmax(tag_logits, -1).cpu()
                 per_sentence_tag_idxs = torch.split_with_sizes(tag_idxs, [len(sentence) + 2 for sentence in sentences])
                 per_sentence_tags = [[self.tag_vocab.value(idx) for idx in idxs[1:-1]] for idxs in per_sentence_tag_idxs]
+                sentences = [list(zip(tags, [x[1] for x in sentence])) for tags, sentence in zip(per_sentence_tags, sentences)]
 
-            for i, (start, end) in enumerate(zip(fp_startpoints, fp_endpoints)):
-                sentence = sentences[i]
-                if self.f_tag is not None:
-                    sentence = list(zip(per_sentence_tags[i], [x[1] for x in sentence]))
-                tree, score = self.parse_from_annotations(fencepost_annotations_start[start:end,:], fencepost_annotations_end[start:end,:], sentence, golds[i])
-                trees.append(tree)
-                scores.append(score)
-            return trees, scores
+            packed_label_scores = self.packed_label_scores_from_annotations(fencepost_annotations_start, fencepost_annotations_end, fp_startpoints, fp_endpoints)
+            return self.decode_from_chart_batch(sentences, packed_label_scores, packed=True, make_trees=make_trees)
 
         # During training time, the forward pass needs to be computed for every
         # cell of the chart, but the backward pass only needs to be computed for
@@ -1162,6 +1337,52 @@ class NKChartParser(nn.Module):
             ], 2)
         return label_scores_chart
 
+    def packed_label_scores_from_annotations(self, fencepost_annotations_start, fencepost_annotations_end, fp_startpoints, fp_endpoints):
+        # Scores only the valid spans (i < j) of each sentence, packed in the
+        # row-major order that chart_helper.decode_packed reads, which takes
+        # about half the memory of full (n+1, n+1) charts. The spans of
+        # several sentences are scored together in one f_label call, of at
+        # most LABEL_CHART_MAX_CELLS spans (unless one sentence has more).
+        groups = []
+        group = []
+        group_cells = 0
+        for start, end in zip(fp_startpoints, fp_endpoints):
+            num_cells = num_packed_spans(end - start)
+            if group and group_cells + num_cells > LABEL_CHART_MAX_CELLS:
+                groups.append(group)
+                group = []
+                group_cells = 0
+            group.append((start, end))
+            group_cells += num_cells
+        if group:
+            groups.append(group)
+
+        all_label_scores = []
+        for group in groups:
+            span_starts, span_ends = zip(*[packed_span_fenceposts(end - start) for start, end in group])
+            offsets = [start for start, _ in group]
+            cells_i = from_numpy(np.concatenate([span_start + offset for span_start, offset in zip(span_starts, offsets)]))
+            cells_j = from_numpy(np.concatenate([span_end + offset for span_end, offset in zip(span_ends, offsets)]))
+
+            label_scores = self.f_label(fencepost_annotations_end[cells_j] - fencepost_annotations_start[cells_i])
+            label_scores = torch.cat([
+                label_scores.new_zeros((label_scores.size(0), 1)),
+                label_scores
+                ], 1)
+            label_scores_np = label_scores.cpu().data.numpy()
+            all_label_scores.extend(np.split(label_scores_np, np.cumsum([len(span_start) for span_start in span_starts])[:-1]))
+        return all_label_scores
+
+    def label_scores_charts_from_annotations(self, fencepost_annotations_start, fencepost_annotations_end, fp_startpoints, fp_endpoints):
+        # Full (n+1, n+1) charts, with zeros for the spans with i >= j
+        charts = []
+        packed_label_scores = self.packed_label_scores_from_annotations(fencepost_annotations_start, fencepost_annotations_end, fp_startpoints, fp_endpoints)
+        for start, end, label_scores in zip(fp_startpoints, fp_endpoints, packed_label_scores):
+            chart = np.zeros((end - start, end - start, label_scores.shape[1]), dtype=label_scores.dtype)
+            chart[packed_span_fenceposts(end - start)] = label_scores
+            charts.append(chart)
+        return charts
+
     def parse_from_annotations(self, fencepost_annotations_start, fencepost_annotations_end, sentence, gold=None):
         is_train = gold is not None
         label_scores_chart = self.label_scores_from_annotations(fencepost_annotations_start, fencepost_annotations_end)
@@ -1175,27 +1396,37 @@ class NKChartParser(nn.Module):
                 label_vocab=self.label_vocab,
                 is_train=is_train)
 
-            p_score, p_i, p_j, p_label, p_augment = chart_helper.decode(False, **decoder_args)
-            g_score, g_i, g_j, g_label, g_augment = chart_helper.decode(True, **decoder_args)
+            p_score, p_i, p_j, p_label, p_augment = get_chart_helper().decode(False, **decoder_args)
+            g_score, g_i, g_j, g_label, g_augment = get_chart_helper().decode(True, **decoder_args)
             return p_i, p_j, p_label, p_augment, g_i, g_j, g_label
         else:
             return self.decode_from_chart(sentence, label_scores_chart_np)
 
-    def decode_from_chart_batch(self, sentences, charts_np, golds=None):
+    def decode_from_chart_batch(self, sentences, charts_np, golds=None, packed=False, make_trees=True):
         trees = []
         scores = []
         if golds is None:
             golds = [None] * len(sentences)
-        for sentence, chart_np, gold in zip(sentences, charts_np, golds):
-            tree, score = self.decode_from_chart(sentence, chart_np, gold)
+        # chart_helper.decode releases the GIL, so sentences are decoded in
+        # parallel threads, as many as torch uses for the neural network
+        num_threads = torch.get_num_threads()
+        get_chart_helper()
+        if num_threads > 1 and len(sentences) > 1:
+            results = get_decode_executor(num_threads).map(self.decode_from_chart, sentences, charts_np, golds, itertools.repeat(packed), itertools.repeat(make_trees))
+        else:
+            results = map(self.decode_from_chart, sentences, charts_np, golds, itertools.repeat(packed), itertools.repeat(make_trees))
+        for tree, score in results:
             trees.append(tree)
             scores.append(score)
         return trees, scores
 
-    def decode_from_chart(self, sentence, chart_np, gold=None):
+    def decode_from_chart(self, sentence, chart_np, gold=None, packed=False, make_tree=True):
+        # chart_np is either a full (n+1, n+1, labels) chart, or packed
+        # (n(n+1)/2, labels) label scores if packed is set. Without
+        # make_tree, the decoded spans are returned as a trees.SpanParse
+        # instead of a trees.InternalParseNode.
         decoder_args = dict(
             sentence_len=len(sentence),
-            label_scores_chart=chart_np,
             gold=gold,
             label_vocab=self.label_vocab,
             is_train=False)
@@ -1205,7 +1436,12 @@ class NKChartParser(nn.Module):
         # The optimized cython decoder implementation doesn't actually
         # generate trees, only scores and span indices. When converting to a
         # tree, we assume that the indices follow a preorder traversal.
-        score, p_i, p_j, p_label, _ = chart_helper.decode(force_gold, **decoder_args)
+        if packed:
+            score, p_i, p_j, p_label, _ = get_chart_helper().decode_packed(force_gold, packed_label_scores=chart_np, **decoder_args)
+        else:
+            score, p_i, p_j, p_label, _ = get_chart_helper().decode(force_gold, label_scores_chart=chart_np, **decoder_args)
+        if not make_tree:
+            return trees.SpanParse(sentence, p_i, p_j, [self.label_vocab.value(label_idx) for label_idx in p_label]), score
         last_splits = []
         idx = -1
         def make_tree():
@@ -131,6 +131,25 @@ class LeafParseNode(ParseNode):
     def convert(self):
         return LeafTreebankNode(self.tag, self.word)
 
+class SpanParse(collections.namedtuple("SpanParse", ["sentence", "starts", "ends", "labels"])):
+    # A predicted tree as the spans chart_helper.decode returns, in preorder:
+    # span k covers sentence[starts[k]:ends[k]] and is labelled labels[k],
+    # a tuple of labels as in InternalParseNode, which is empty for spans
+    # that are not constituents
+
+    def linearize(self):
+        # Same as building the InternalParseNode and calling
+        # .convert().linearize(), without creating the nodes
+        opens = [""] * len(self.sentence)
+        closes = [""] * len(self.sentence)
+        for start, end, label in zip(self.starts, self.ends, self.labels):
+            if label:
+                opens[start] += "(" + " (".join(label) + " "
+                closes[end - 1] += ")" * len(label)
+        return " ".join(
+            "{}({} {}){}".format(open_brackets, tag, word, close_brackets)
+            for open_brackets, (tag, word), close_brackets in zip(opens, self.sentence, closes))
+
 
 def tree_from_str(treebank, strip_top=True, strip_spmrl_features=True):
     # Features bounded by `##` may contain spaces, so if we strip the features
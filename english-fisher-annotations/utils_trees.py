@@ -27,10 +27,12 @@ def get_annotated_transcript(tree):
 
 # this function is used for getting (our way of) formatting transcripts from the trees
 def get_intj_prn_edited_transcript_from_tree_file(filepath):
-    tb_file = tb.read_file(filepath)
-    
+    return get_intj_prn_edited_transcript_from_trees(tb.read_file(filepath))
+
+# same as above, for trees that are already in memory (e.g. from tb.string_trees)
+def get_intj_prn_edited_transcript_from_trees(trees):
     line_annotations = []
-    for line in tb_file:
+    for line in trees:
         line_annotations.append(" ".join(list(get_annotated_transcript(line))))
         
     return " ".join(line_annotations)
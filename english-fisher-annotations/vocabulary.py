@@ -40,5 +40,14 @@ class Vocabulary(object):
     def count(self, value):
         return self.counts[value]
 
+    def index_map(self, min_count=0, keep=()):
+        # Plain dict for looking up many values at once; values seen fewer
+        # than min_count times are left out unless they are in keep
+        assert self.frozen
+        return {
+            value: index for value, index in self.indices.items()
+            if self.counts.get(value, 0) >= min_count or value in keep
+            }
+
     def freeze(self):
         self.frozen = True
\ No newline at end of file
@@ -0,0 +1,70 @@
+import collections
+import concurrent.futures
+import subprocess
+
+import numpy as np
+
+# the sample rate WhisperX expects (whisperx.audio.SAMPLE_RATE)
+SAMPLE_RATE = 16000
+
+def get_ffmpeg_cmd(input_path, time_to_truncate_to_in_seconds=None, sample_rate=SAMPLE_RATE):
+    # decodes (the start of) the file to mono float32 PCM at sample_rate, written to stdout;
+    # remove "-loglevel error" to show traditional ffmpeg output
+    cmd = "ffmpeg -nostdin -hide_banner -loglevel error -threads 0".split()
+    if time_to_truncate_to_in_seconds is not None:
+        cmd += ["-t", f"{time_to_truncate_to_in_seconds}"]
+
+    # the paths may have spaces in them from the Spotify dataset, so they are passed as a single argument
+    cmd += ["-i", f"{input_path}"]
+
+    cmd += f"-f f32le -acodec pcm_f32le -ac 1 -ar {sample_rate} pipe:1".split()
+    return cmd
+
+def load_audio(input_path, time_to_truncate_to_in_seconds=None, sample_rate=SAMPLE_RATE):
+    # same as whisperx.load_audio, but truncates the audio while decoding it, and reads ffmpeg's
+    # float32 output straight into the returned (read-only) array, without a temp file or a copy
+    result = subprocess.run(
+        get_ffmpeg_cmd(input_path, time_to_truncate_to_in_seconds, sample_rate),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to load audio {input_path}: {result.stderr.decode(errors='replace')}")
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+def prefetch_audio(items, load, num_workers=2, queue_depth=4, max_buffered_mb=None):
+    # yields (item, load(item)) for each item, in order, while num_workers threads decode the
+    # next items in the background (ffmpeg runs in its own process, so the threads mostly wait
+    # on it, and the caller can keep the GPU busy); at most queue_depth items are decoded ahead,
+    # and no more are started once the decoded audio waiting to be used reaches max_buffered_mb
+    # (the decodes already running can still take it past that, by at most num_workers episodes);
+    # one item is always decoded when nothing is waiting, however small max_buffered_mb is
+    items = iter(items)
+    max_buffered_bytes = None if max_buffered_mb is None else max_buffered_mb * 2**20
+    pending = collections.deque()
+    no_more_items = object()
+
+    def get_buffered_bytes():
+        # (load may return something other than an array, e.g. an error)
+        return sum(getattr(future.result(), "nbytes", 0) for _, future in pending if future.done() and not future.exception())
+
+    def submit_more():
+        while len(pending) < queue_depth and (not pending or max_buffered_bytes is None or get_buffered_bytes() < max_buffered_bytes):
+            item = next(items, no_more_items)
+            if item is no_more_items:
+                return
+            pending.append((item, executor.submit(load, item)))
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+    try:
+        submit_more()
+        while pending:
+            item, future = pending.popleft()
+            audio = future.result()
+            submit_more()
+            yield item, audio
+    finally:
+        # e.g. when the caller stops early, the items not started yet are dropped
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 import shutil
 
@@ -42,6 +44,35 @@ def read_file(filepath):
         text = f.read()
     return text
 
+def append_jsonl_records(filepath, records):
+    # one JSON object per line; flushed and fsync'd once per call, so a batch of records 
+    # costs one sync no matter how large the file has grown
+    prefix = ""
+    if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+        with open(filepath, mode="rb") as f:
+            f.seek(-1, os.SEEK_END)
+            # start on a new line after a partially written last line
+            if f.read(1) != b"\n":
+                prefix = "\n"
+    with open(filepath, mode="a") as f:
+        f.write(prefix)
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_jsonl_records(filepath):
+    records = []
+    if os.path.exists(filepath):
+        with open(filepath) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # a partially written line, from a run that was killed mid-write
+                    continue
+    return records
+
 def delete_file_if_already_exists(filepath):
     if os.path.exists(filepath):
         os.remove(filepath)
@@ -83,4 +114,20 @@ def count_num_files(input_dir, file_extension):
             num_files += len(files_matching_extension)
     return num_files
     
-    
\ No newline at end of file
+    
+
+def get_shard_index(key, num_shards):
+    # md5 rather than hash(), which is salted per process, so that every script on every node 
+    # assigns an episode (e.g. its episode_filename_prefix) to the same shard
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16) % num_shards
+
+def is_in_shard(key, num_shards, shard_index):
+    return get_shard_index(key, num_shards) == shard_index
+
+def add_shard_arguments(parser):
+    parser.add_argument("--num-shards", type=int, default=1, help="Number of shards the episodes are split into.")
+    parser.add_argument("--shard-index", type=int, default=0, help="Index of the shard to run, from 0 to num-shards - 1.")
+
+def check_shard_arguments(parser, args):
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error(f"--shard-index must be between 0 and {args.num_shards - 1}")